@@ -21,8 +21,11 @@ login = LoginManager() # <-- NOVO
 login.login_view = 'auth.login' # <-- Define qual é a rota de login
 login.login_message = 'Por favor, faça login para acessar esta página.'
 
-def create_app():
-    """Fábrica de Aplicação"""
+def create_app(test_config=None):
+    """
+    Fábrica de Aplicação
+    'test_config' (opcional) sobrescreve a configuração (ex: banco de testes/carga).
+    """
     
     app = Flask(__name__, 
                 instance_relative_config=True,
@@ -33,6 +36,24 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(app.instance_path, 'database.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379')
+    app.config['REDIS_MAX_CONNECTIONS'] = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50)) # por processo
+
+    # --- Workers / filas por prioridade ---
+    app.config['BULK_QUEUE_THRESHOLD'] = int(os.environ.get('BULK_QUEUE_THRESHOLD', 5000)) # destinatários
+    app.config['WORKER_PROCESSES'] = int(os.environ.get('WORKER_PROCESSES', 2))
+    app.config['WORKER_BATCH_SIZE'] = int(os.environ.get('WORKER_BATCH_SIZE', 100)) # destinatários por lote/commit
+
+    # --- Reenvio automático (falhas transitórias de SMTP) ---
+    app.config['RETRY_MAX_ATTEMPTS'] = int(os.environ.get('RETRY_MAX_ATTEMPTS', 4))
+    app.config['RETRY_BASE_DELAY'] = int(os.environ.get('RETRY_BASE_DELAY', 60)) # segundos (dobra a cada tentativa)
+    app.config['RETRY_BATCH_SIZE'] = int(os.environ.get('RETRY_BATCH_SIZE', 200))
+
+    # --- Relays SMTP (failover) ---
+    app.config['RELAY_FAILURE_THRESHOLD'] = int(os.environ.get('RELAY_FAILURE_THRESHOLD', 3)) # falhas seguidas
+    app.config['RELAY_COOLDOWN'] = int(os.environ.get('RELAY_COOLDOWN', 300)) # segundos fora do rodízio
+
+    if test_config:
+        app.config.update(test_config)
 
     try:
         os.makedirs(app.instance_path)
@@ -0,0 +1,125 @@
+"""
+Arquivamento de campanhas concluídas.
+Os destinatários de campanhas concluídas há mais de N dias saem da tabela
+'recipient' e vão para um arquivo compactado por campanha
+(instance/archive/campaign_<id>.jsonl.gz, um JSON por linha). No banco
+ficam só os totais por status (Campaign.archive_counts); a página de
+detalhes e a exportação leem o arquivo quando pedido.
+"""
+import datetime
+import gzip
+import json
+import os
+
+from flask import current_app
+from sqlalchemy import delete, func
+
+from app import db
+from app import recipients
+from app.models import Campaign, Recipient
+
+ARCHIVE_BATCH_SIZE = 5000
+
+
+def archive_path(campaign_id):
+    """Caminho do arquivo de destinatários arquivados da campanha."""
+    return os.path.join(current_app.instance_path, 'archive', f'campaign_{campaign_id}.jsonl.gz')
+
+
+def _iter_archive_rows(campaign, batch_size=ARCHIVE_BATCH_SIZE):
+    """Linhas do arquivo (dicts), com os dados do contato e só os campos da campanha."""
+    lead_fields = campaign.lead_fields or []
+    rows = recipients.iter_recipient_rows(campaign.id, (Recipient.contact_id, Recipient.attempt_history),
+                                          batch_size=batch_size)
+    for row in rows:
+        fields = row.fields or {}
+        yield {
+            'id': row.id,
+            'contact_id': row.contact_id,
+            'nome': row.nome,
+            'email': row.email,
+            'status': row.status,
+            'variant': row.variant,
+            'attempts': row.attempts,
+            'attempt_history': row.attempt_history,
+            'fields': {name: fields.get(name, '') for name in lead_fields},
+        }
+
+
+def archive_campaign(campaign):
+    """
+    Move os destinatários da campanha para o arquivo compactado.
+    O arquivo é gravado (e fechado) ANTES de apagar as linhas do banco;
+    se algo falhar no meio, basta rodar de novo.
+    Retorna o nº de destinatários arquivados, ou None se a campanha não puder ser arquivada.
+    """
+    if campaign.archived_at:
+        return None
+    pending = db.session.execute(
+        db.select(Recipient.id)
+        .where(Recipient.campaign_id == campaign.id, Recipient.status == 'Aguardando Reenvio')
+        .limit(1)
+    ).first()
+    if pending:
+        print(f"[Arquivo] Campanha {campaign.id} ainda tem reenvios pendentes. Pulando.")
+        return None
+
+    path = archive_path(campaign.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    counts = {}
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=9) as f:
+        for row in _iter_archive_rows(campaign):
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+    os.replace(tmp_path, path)
+
+    db.session.execute(delete(Recipient).where(Recipient.campaign_id == campaign.id))
+    campaign.archive_counts = counts
+    campaign.archived_at = datetime.datetime.utcnow()
+    db.session.commit()
+
+    total = sum(counts.values())
+    print(f"[Arquivo] Campanha {campaign.id}: {total} destinatários arquivados em {path} "
+          f"({os.path.getsize(path) / 1024:.1f} KB).")
+    return total
+
+
+def campaigns_to_archive(days):
+    """Campanhas concluídas há mais de 'days' dias e ainda não arquivadas (ids)."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    # Campanhas antigas (sem completed_at) usam a data de criação
+    finished_at = func.coalesce(Campaign.completed_at, Campaign.created_at)
+    return list(db.session.scalars(
+        db.select(Campaign.id)
+        .where(Campaign.archived_at.is_(None),
+               Campaign.status.like('Concluído%'),
+               finished_at <= cutoff)
+        .order_by(Campaign.id)
+    ))
+
+
+def archive_completed_campaigns(days):
+    """Arquiva todas as campanhas elegíveis. Retorna (campanhas arquivadas, destinatários arquivados)."""
+    campaign_ids = campaigns_to_archive(days)
+    print(f"[Arquivo] {len(campaign_ids)} campanhas concluídas há mais de {days} dias.")
+    archived = 0
+    recipients = 0
+    for campaign_id in campaign_ids:
+        campaign = db.session.get(Campaign, campaign_id)
+        total = archive_campaign(campaign)
+        if total is not None:
+            archived += 1
+            recipients += total
+    return archived, recipients
+
+
+def iter_archived_recipients(campaign_id):
+    """Lê o arquivo da campanha, um destinatário (dict) por vez."""
+    path = archive_path(campaign_id)
+    if not os.path.exists(path):
+        print(f"[Arquivo] Aviso: arquivo {path} não encontrado.")
+        return
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
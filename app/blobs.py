@@ -0,0 +1,154 @@
+"""
+Armazenamento do HTML das campanhas por conteúdo (hash SHA-256).
+Cada HTML distinto é gravado UMA vez, compactado com zlib; campanhas e
+variações guardam só o hash. A leitura passa por um pequeno cache LRU
+(o conteúdo de um hash nunca muda, então o cache nunca fica desatualizado).
+"""
+import datetime
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from sqlalchemy import insert, inspect, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import HtmlBlob, Campaign, CampaignVariant
+
+COMPRESS_LEVEL = 9 # Grava uma vez, lê muitas: vale a compressão máxima
+
+_BLOB_CACHE = OrderedDict()
+_BLOB_CACHE_LOCK = threading.Lock()
+BLOB_CACHE_MAX_ENTRIES = 64
+
+# Colunas de HTML das versões antigas (antes do html_blob): (modelo, coluna)
+LEGACY_HTML_COLUMNS = ((Campaign, 'generated_html'), (CampaignVariant, 'html'))
+MIGRATE_BATCH_SIZE = 200
+
+
+def html_hash(html):
+    """Chave do blob: SHA-256 (hex) do HTML em UTF-8."""
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+def _cache_get(key):
+    with _BLOB_CACHE_LOCK:
+        html = _BLOB_CACHE.get(key)
+        if html is not None:
+            _BLOB_CACHE.move_to_end(key)
+        return html
+
+
+def _cache_set(key, html):
+    with _BLOB_CACHE_LOCK:
+        _BLOB_CACHE[key] = html
+        _BLOB_CACHE.move_to_end(key)
+        while len(_BLOB_CACHE) > BLOB_CACHE_MAX_ENTRIES:
+            _BLOB_CACHE.popitem(last=False)
+
+
+def _insert_ignore(**values):
+    """
+    INSERT do blob que não falha se o hash já existir (outro processo pode
+    gravar o mesmo HTML entre o SELECT e o INSERT).
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(HtmlBlob).values(**values).on_conflict_do_nothing(index_elements=['hash'])
+    if dialect == 'postgresql':
+        return postgresql.insert(HtmlBlob).values(**values).on_conflict_do_nothing(index_elements=['hash'])
+    if dialect in ('mysql', 'mariadb'):
+        return mysql.insert(HtmlBlob).values(**values).prefix_with('IGNORE')
+    return None
+
+
+def put_html(html):
+    """
+    Grava o HTML (se ainda não existir) e retorna o hash.
+    O INSERT é imediato (sem autoflush) para poder ser chamado no meio da
+    montagem de uma Campaign/CampaignVariant.
+    """
+    key = html_hash(html)
+    with db.session.no_autoflush:
+        exists = db.session.execute(db.select(HtmlBlob.hash).where(HtmlBlob.hash == key)).first()
+        if not exists:
+            raw = html.encode('utf-8')
+            values = dict(hash=key, data=zlib.compress(raw, COMPRESS_LEVEL), size=len(raw),
+                          created_at=datetime.datetime.utcnow())
+            stmt = _insert_ignore(**values)
+            if stmt is not None:
+                db.session.execute(stmt)
+            else:
+                # Banco sem "INSERT ... ON CONFLICT": savepoint, e o conflito é ignorado
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(insert(HtmlBlob).values(**values))
+                except IntegrityError:
+                    pass
+    _cache_set(key, html)
+    return key
+
+
+def get_html(key):
+    """HTML do blob 'key' (descompactado), ou None se não existir."""
+    if not key:
+        return None
+    html = _cache_get(key)
+    if html is not None:
+        return html
+    data = db.session.execute(db.select(HtmlBlob.data).where(HtmlBlob.hash == key)).scalar()
+    if data is None:
+        return None
+    html = zlib.decompress(data).decode('utf-8')
+    _cache_set(key, html)
+    return html
+
+
+def migrate_legacy_html(batch_size=MIGRATE_BATCH_SIZE):
+    """
+    Migração de dados para bancos criados antes do html_blob.
+    Para cada tabela que ainda tem a coluna antiga de HTML: cria a coluna
+    html_hash (se faltar), grava cada HTML como blob, preenche o hash e, no
+    fim, remove a coluna antiga (a de campaign_variant é NOT NULL e
+    impediria novos INSERTs). Pode ser rodada de novo se parar no meio.
+    Deve rodar ANTES de qualquer upgrade de schema que remova as colunas antigas.
+    Retorna {tabela: nº de linhas migradas}.
+    """
+    # Só a tabela html_blob: as demais ficam com o Flask-Migrate
+    HtmlBlob.__table__.create(db.engine, checkfirst=True)
+    migrated = {}
+    for model, legacy_column in LEGACY_HTML_COLUMNS:
+        table = model.__table__
+        columns = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+        if legacy_column not in columns:
+            continue
+        if 'html_hash' not in columns:
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN html_hash VARCHAR(64)'))
+            db.session.commit()
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+        total = 0
+        last_id = 0
+        while True:
+            batch = db.session.execute(text(
+                f'SELECT id, {legacy_column} FROM {table.name} '
+                f'WHERE id > :last_id AND html_hash IS NULL AND {legacy_column} IS NOT NULL '
+                f'ORDER BY id LIMIT :limit'
+            ), {'last_id': last_id, 'limit': batch_size}).all()
+            if not batch:
+                break
+            for row_id, html in batch:
+                db.session.execute(text(f'UPDATE {table.name} SET html_hash = :key WHERE id = :id'),
+                                   {'key': put_html(html), 'id': row_id})
+            db.session.commit()
+            total += len(batch)
+            last_id = batch[-1][0]
+
+        db.session.execute(text(f'ALTER TABLE {table.name} DROP COLUMN {legacy_column}'))
+        db.session.commit()
+        migrated[table.name] = total
+        print(f"[Blobs] {table.name}.{legacy_column}: {total} HTMLs migrados para html_blob; coluna removida.")
+    return migrated
@@ -1,6 +1,12 @@
 import click
+import time
 from . import db
-from .models import User
+from . import core_logic
+from . import archive
+from . import task_queue
+from . import blobs
+from . import contacts
+from .models import User, Campaign
 
 def register(app):
     @app.cli.command("create-admin")
@@ -29,4 +35,91 @@ def register(app):
             db.session.commit()
             print(f"✅ Sucesso! Usuário Admin '{username}' criado.")
         except Exception as e:
-            print(f"Erro ao criar usuário: {e}")
\ No newline at end of file
+            print(f"Erro ao criar usuário: {e}")
+
+    @app.cli.command("archive-campaigns")
+    @click.option("--days", type=int, default=90, help="Arquiva campanhas concluídas há mais de N dias.")
+    @click.option("--enqueue", is_flag=True, help="Em vez de rodar agora, coloca a tarefa na fila do worker (RQ).")
+    @click.option("--every-hours", type=int, default=None, help="Com --enqueue: repete o arquivamento a cada N horas.")
+    def archive_campaigns(days, enqueue, every_hours):
+        """
+        Move os destinatários de campanhas concluídas para arquivos compactados (instance/archive).
+        Uso: flask archive-campaigns --days 90
+             flask archive-campaigns --days 90 --enqueue --every-hours 24
+        """
+        if enqueue:
+            jobs = task_queue.enqueue_many(task_queue.ARCHIVE_TASK, [(days, every_hours)],
+                                           queue_name=task_queue.SCHEDULED_QUEUE)
+            repeat = f", repetindo a cada {every_hours}h" if every_hours else ""
+            print(f"✅ Arquivamento enfileirado (tarefa {jobs[0].id}{repeat}).")
+            return
+
+        archived, recipients = archive.archive_completed_campaigns(days)
+        print(f"✅ {archived} campanhas arquivadas ({recipients} destinatários).")
+
+    @app.cli.command("migrate-html-blobs")
+    def migrate_html_blobs():
+        """
+        Migra o HTML salvo nas colunas antigas (campaign.generated_html e
+        campaign_variant.html) para a tabela html_blob. Rodar uma vez ao atualizar.
+        Uso: flask migrate-html-blobs
+        """
+        migrated = blobs.migrate_legacy_html()
+        if not migrated:
+            print("Nada a migrar: o banco já usa a tabela html_blob.")
+            return
+        print(f"✅ HTML migrado: {', '.join(f'{table}: {count}' for table, count in migrated.items())}.")
+
+    @app.cli.command("migrate-recipient-contacts")
+    def migrate_recipient_contacts():
+        """
+        Migra nome, e-mail e campos dos destinatários antigos (colunas
+        recipient.nome/email/fields) para o cadastro de contatos. Rodar uma vez ao atualizar.
+        Uso: flask migrate-recipient-contacts
+        """
+        total = contacts.migrate_legacy_recipients()
+        if total is None:
+            print("Nada a migrar: os destinatários já usam o cadastro de contatos.")
+            return
+        print(f"✅ {total} destinatários migrados para o cadastro de contatos.")
+
+    @app.cli.command("bench-compaction")
+    @click.option("--campaign-id", type=int, default=None, help="Campanha usada como amostra (padrão: a mais recente).")
+    @click.option("--html-file", type=click.Path(exists=True), default=None, help="Arquivo HTML usado como amostra.")
+    @click.option("--messages", type=int, default=1000, help="Quantidade de mensagens simuladas.")
+    @click.option("--mbps", type=float, default=10.0, help="Banda de upload (Mbit/s) para estimar o tempo de transferência.")
+    def bench_compaction(campaign_id, html_file, messages, mbps):
+        """
+        Compara tamanho e tempo de montagem das mensagens antes/depois da compactação.
+        Uso: flask bench-compaction --html-file email.html --messages 5000
+        """
+        if html_file:
+            with open(html_file, encoding='utf-8') as f:
+                html = f.read()
+        else:
+            if campaign_id:
+                campaign = db.session.get(Campaign, campaign_id)
+            else:
+                campaign = db.session.query(Campaign).order_by(Campaign.id.desc()).first()
+            if not campaign or not campaign.generated_html:
+                print("Erro: Nenhuma campanha com HTML encontrada (use --html-file).")
+                return
+            html = campaign.generated_html
+
+        def run(body):
+            template = core_logic.compile_template(body)
+            total_bytes = 0
+            start = time.perf_counter()
+            for i in range(messages):
+                fields = core_logic.build_recipient_fields(f'Lead {i}', f'lead{i}@example.com')
+                msg = core_logic.build_message('bench@example.com', fields['EMAIL'], 'Benchmark', template.render(fields))
+                total_bytes += len(msg.as_bytes())
+            return total_bytes, time.perf_counter() - start
+
+        compact = core_logic.compact_html(html)
+        print(f"HTML: {len(html.encode('utf-8'))} -> {len(compact.encode('utf-8'))} bytes")
+        for label, body in (('Original', html), ('Compactado', compact)):
+            total_bytes, elapsed = run(body)
+            transfer = total_bytes * 8 / (mbps * 1_000_000)
+            print(f"{label:<11} {messages} mensagens: {total_bytes / 1048576:.2f} MB, "
+                  f"montagem {elapsed:.2f}s, transferência estimada ({mbps:g} Mbit/s) {transfer:.1f}s")
@@ -0,0 +1,234 @@
+"""
+Cadastro de contatos e listas de leads.
+Importar um CSV grava (ou atualiza) os contatos UMA vez; as campanhas só
+referenciam a lista e criam o estado de entrega (Recipient) de cada contato.
+"""
+import datetime
+import json
+
+from sqlalchemy import insert, update, delete, inspect, text
+
+from app import db
+from app import core_logic
+from app.models import Contact, LeadList, LeadListMember, Recipient
+
+# Nº de e-mails por consulta/insert (abaixo do limite de parâmetros do SQLite)
+IMPORT_CHUNK = 500
+
+# Colunas do Recipient nas versões antigas (antes do Contact)
+LEGACY_RECIPIENT_COLUMNS = ('nome', 'email', 'fields')
+
+
+def normalize_email(email):
+    """E-mail normalizado (chave única do Contact)."""
+    return str(email or '').strip().lower()
+
+
+def _chunks(items, size=IMPORT_CHUNK):
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
+
+def _rows_by_email(leads_df, extra_columns, field_names):
+    """
+    Linhas do CSV indexadas pelo e-mail normalizado (a última ocorrência vence).
+    Retorna {email: (nome, {PLACEHOLDER: valor})}.
+    """
+    rows = {}
+    columns = ['nome', 'email'] + extra_columns
+    for nome, email, *values in leads_df[columns].itertuples(index=False, name=None):
+        email = normalize_email(email)
+        if '@' not in email:
+            continue
+        rows[email] = (str(nome).strip(), dict(zip(field_names, values)))
+    return rows
+
+
+def import_lead_list(name, leads_df, user=None):
+    """
+    Cria ou atualiza a lista 'name' a partir do DataFrame de leads.
+    Só contatos novos são inseridos e só os que mudaram (nome/campos) são
+    atualizados; a associação da lista recebe apenas o que entrou/saiu.
+    Retorna (lead_list, stats), ou (None, stats) se o CSV não tiver nenhum
+    e-mail válido (a lista existente NÃO é esvaziada).
+    """
+    extra_columns = core_logic.get_lead_field_columns(leads_df)
+    field_names = [core_logic.placeholder_name(col) for col in extra_columns]
+    rows = _rows_by_email(leads_df, extra_columns, field_names)
+    now = datetime.datetime.utcnow()
+    stats = {'total': len(rows), 'inserted': 0, 'updated': 0, 'unchanged': 0, 'added': 0, 'removed': 0}
+    if not rows:
+        print(f"[Contatos] Lista '{name}': nenhum e-mail válido no CSV. Importação recusada.")
+        return None, stats
+
+    lead_list = LeadList.query.filter_by(name=name).first()
+    if lead_list is None:
+        lead_list = LeadList(name=name, user=user, created_at=now)
+        db.session.add(lead_list)
+        db.session.flush()
+
+    # 1. Upsert dos contatos (por lotes de e-mails)
+    contact_ids = set()
+    for emails in _chunks(list(rows)):
+        existing = {
+            row.email: row
+            for row in db.session.execute(
+                db.select(Contact.id, Contact.email, Contact.nome, Contact.fields)
+                .where(Contact.email.in_(emails))
+            )
+        }
+
+        new_contacts = []
+        changed_contacts = []
+        for email in emails:
+            nome, fields = rows[email]
+            current = existing.get(email)
+            if current is None:
+                new_contacts.append({'email': email, 'nome': nome, 'fields': fields or None, 'updated_at': now})
+                continue
+            contact_ids.add(current.id)
+            # Mescla: colunas que esta lista não tem são preservadas
+            merged = dict(current.fields or {})
+            merged.update(fields)
+            if current.nome != nome or merged != (current.fields or {}):
+                changed_contacts.append({'id': current.id, 'nome': nome, 'fields': merged or None, 'updated_at': now})
+
+        if new_contacts:
+            db.session.execute(insert(Contact), new_contacts)
+            contact_ids.update(db.session.scalars(
+                db.select(Contact.id).where(Contact.email.in_([c['email'] for c in new_contacts]))
+            ))
+        if changed_contacts:
+            # UPDATE em lote pela chave primária
+            db.session.execute(update(Contact), changed_contacts)
+
+        stats['inserted'] += len(new_contacts)
+        stats['updated'] += len(changed_contacts)
+        stats['unchanged'] += len(emails) - len(new_contacts) - len(changed_contacts)
+
+    # 2. Associação da lista: adiciona quem entrou, remove quem saiu
+    current_members = set(db.session.scalars(
+        db.select(LeadListMember.contact_id).where(LeadListMember.list_id == lead_list.id)
+    ))
+    to_add = sorted(contact_ids - current_members)
+    to_remove = sorted(current_members - contact_ids)
+    for ids in _chunks(to_add):
+        db.session.execute(insert(LeadListMember), [{'list_id': lead_list.id, 'contact_id': cid} for cid in ids])
+    for ids in _chunks(to_remove):
+        db.session.execute(
+            delete(LeadListMember)
+            .where(LeadListMember.list_id == lead_list.id, LeadListMember.contact_id.in_(ids))
+        )
+    stats['added'] = len(to_add)
+    stats['removed'] = len(to_remove)
+
+    lead_list.field_names = field_names or None
+    lead_list.contact_count = len(contact_ids)
+    lead_list.updated_at = now
+    db.session.commit()
+
+    print(f"[Contatos] Lista '{name}': {stats['total']} leads "
+          f"(novos: {stats['inserted']}, alterados: {stats['updated']}, iguais: {stats['unchanged']}; "
+          f"entraram: {stats['added']}, saíram: {stats['removed']}).")
+    return lead_list, stats
+
+
+def _legacy_fields(values, names):
+    """Recipient.fields antigo (lista alinhada com Campaign.lead_fields) -> {PLACEHOLDER: valor}."""
+    if isinstance(values, str):
+        values = json.loads(values)
+    if isinstance(names, str):
+        names = json.loads(names)
+    if not values or not names:
+        return {}
+    return {name: value for name, value in zip(names, values)}
+
+
+def migrate_legacy_recipients(batch_size=IMPORT_CHUNK):
+    """
+    Migração de dados para bancos criados antes do Contact.
+    Copia nome/e-mail/campos dos destinatários antigos para o Contact (um por
+    e-mail normalizado), preenche recipient.contact_id e, no fim, remove as
+    colunas antigas. Os destinatários são lidos do mais novo para o mais
+    antigo e nada é sobrescrito: vale o dado mais recente (e o de contatos
+    já cadastrados). Pode ser rodada de novo se parar no meio.
+    Deve rodar ANTES de qualquer upgrade de schema que remova as colunas antigas.
+    Retorna o nº de destinatários migrados, ou None se não havia nada a migrar.
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('recipient')}
+    if 'email' not in columns:
+        return None
+    # Só a tabela contact: as demais ficam com o Flask-Migrate
+    Contact.__table__.create(db.engine, checkfirst=True)
+    if 'contact_id' not in columns:
+        db.session.execute(text('ALTER TABLE recipient ADD COLUMN contact_id INTEGER'))
+        db.session.commit()
+    for index in Recipient.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+    campaign_columns = {column['name'] for column in inspect(db.engine).get_columns('campaign')}
+    has_fields = 'fields' in columns and 'lead_fields' in campaign_columns
+    fields_sql = 'r.fields, c.lead_fields' if has_fields else 'NULL, NULL'
+    now = datetime.datetime.utcnow()
+    total = 0
+    last_id = None
+    while True:
+        keyset = '' if last_id is None else 'AND r.id < :last_id '
+        batch = db.session.execute(text(
+            f'SELECT r.id, r.nome, r.email, {fields_sql} FROM recipient r '
+            f'LEFT JOIN campaign c ON c.id = r.campaign_id '
+            f'WHERE r.contact_id IS NULL {keyset}'
+            f'ORDER BY r.id DESC LIMIT :limit'
+        ), {'last_id': last_id, 'limit': batch_size}).all()
+        if not batch:
+            break
+
+        # Mais novo primeiro: a primeira ocorrência de cada e-mail vence
+        rows = {}
+        for row_id, nome, email, values, names in batch:
+            email = normalize_email(email)
+            _, fields = rows.setdefault(email, (str(nome or '').strip(), {}))
+            for name, value in _legacy_fields(values, names).items():
+                fields.setdefault(name, value)
+        existing = {
+            row.email: row
+            for row in db.session.execute(
+                db.select(Contact.id, Contact.email, Contact.fields).where(Contact.email.in_(list(rows)))
+            )
+        }
+        new_contacts = []
+        changed_contacts = []
+        for email, (nome, fields) in rows.items():
+            current = existing.get(email)
+            if current is None:
+                new_contacts.append({'email': email, 'nome': nome, 'fields': fields or None, 'updated_at': now})
+                continue
+            # Só completa os campos que o contato ainda não tem
+            merged = dict(fields)
+            merged.update(current.fields or {})
+            if merged != (current.fields or {}):
+                changed_contacts.append({'id': current.id, 'fields': merged})
+        if new_contacts:
+            db.session.execute(insert(Contact), new_contacts)
+        if changed_contacts:
+            db.session.execute(update(Contact), changed_contacts)
+
+        contact_ids = dict(db.session.execute(
+            db.select(Contact.email, Contact.id).where(Contact.email.in_(list(rows)))
+        ).all())
+        db.session.execute(
+            text('UPDATE recipient SET contact_id = :contact_id WHERE id = :id'),
+            [{'contact_id': contact_ids[normalize_email(email)], 'id': row_id}
+             for row_id, nome, email, values, names in batch]
+        )
+        db.session.commit()
+        total += len(batch)
+        last_id = batch[-1][0]
+
+    for column in LEGACY_RECIPIENT_COLUMNS:
+        if column in columns:
+            db.session.execute(text(f'ALTER TABLE recipient DROP COLUMN {column}'))
+    db.session.commit()
+    print(f"[Contatos] {total} destinatários antigos migrados para o cadastro de contatos; "
+          f"colunas antigas removidas.")
+    return total
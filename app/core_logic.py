@@ -1,9 +1,16 @@
 import pandas as pd
 import google.generativeai as genai
 import smtplib
+import socket
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import datetime
+import re
+import html as html_lib
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Lógica de IA ---
 
@@ -29,68 +36,429 @@ def _clean_html_response(raw_text):
         return raw_text.replace("```html", "").replace("```", "").strip()
 
 
-def generate_ai_html(api_key, email_theme, cta_url, company_name, logo_url, model_name='gemini-2.5-flash-lite'):
+def _build_prompt(email_theme, cta_url, company_name, logo_url, variant_index=0, total_variants=1,
+                  extra_placeholders=None):
+    """Monta o prompt enviado ao Gemini (compartilhado entre os modos de geração)."""
+    # --- LÓGICA CONDICIONAL DA LOGO (Seu pedido) ---
+    # Começa com uma instrução vazia
+    logo_instruction = ""
+    if logo_url and logo_url.strip(): # Verifica se a string não é vazia
+        # Se uma URL foi fornecida, adiciona a instrução
+        logo_instruction = f"2. O e-mail DEVE incluir uma logo. Use esta URL: {logo_url}"
+    else:
+        # Se a URL estiver vazia, instrui a IA a NÃO usar uma.
+        logo_instruction = "2. O e-mail NÃO DEVE incluir uma logo nem espaço para ela."
+    # --- FIM DA LÓGICA CONDICIONAL ---
+
+    # --- LÓGICA DO ANO VIGENTE ---
+    ano_vigente = datetime.datetime.now().year
+
+    # --- VARIAÇÕES (Teste A/B) ---
+    variant_instruction = ""
+    if total_variants > 1:
+        variant_instruction = (
+            f"Esta é a variação {variant_index + 1} de {total_variants} de um teste A/B: "
+            f"use título, texto e estilo visual diferentes das outras variações.\n"
+        )
+
+    # --- PLACEHOLDERS EXTRAS (colunas do CSV) ---
+    extra_instruction = ""
+    if extra_placeholders:
+        tags = ", ".join(f"[{name}]" for name in extra_placeholders)
+        extra_instruction = f"Se fizer sentido, você também pode usar estes placeholders: {tags}.\n"
+
+    # --- PROMPT INTELIGENTE FINAL ---
+    prompt = (
+        f"Crie um e-mail marketing em HTML completo (inline CSS) sobre o tema: '{email_theme}'.\n"
+        f"O e-mail deve ser profissional e amigável.\n"
+        f"{variant_instruction}"
+
+        # --- INSTRUÇÕES OBRIGATÓRIAS (Suas features) ---
+        f"1. O botão principal de Call-to-Action (CTA) DEVE apontar para esta URL: {cta_url}\n"
+        f"{logo_instruction}\n"
+        f"3. O nome da empresa é: '{company_name}'. Use-o no rodapé.\n"
+        f"4. O ano de copyright no rodapé DEVE ser o ano vigente: {ano_vigente}.\n"
+
+        # --- PLACEHOLDERS PADRÃO ---
+        f"Use o placeholder [NOME] onde o nome do cliente deve ir.\n"
+        f"{extra_instruction}"
+        f"Coloque o código HTML final dentro de um bloco de código Markdown (```html ... ```)."
+    )
+    return prompt
+
+
+# --- Cache de HTML gerado (por processo) ---
+# Evita repetir a chamada de ~30s quando o mesmo prompt é pedido de novo
+# (ex: o operador volta para "Editar" e gera a prévia sem mudar nada).
+_HTML_CACHE = OrderedDict()
+_HTML_CACHE_LOCK = threading.Lock()
+HTML_CACHE_MAX_ENTRIES = 128
+
+
+def _cache_key(model_name, prompt):
+    return hashlib.sha256(f"{model_name}\n{prompt}".encode('utf-8')).hexdigest()
+
+
+def _cache_get(key):
+    with _HTML_CACHE_LOCK:
+        html = _HTML_CACHE.get(key)
+        if html is not None:
+            _HTML_CACHE.move_to_end(key)
+        return html
+
+
+def _cache_set(key, html):
+    with _HTML_CACHE_LOCK:
+        _HTML_CACHE[key] = html
+        _HTML_CACHE.move_to_end(key)
+        while len(_HTML_CACHE) > HTML_CACHE_MAX_ENTRIES:
+            _HTML_CACHE.popitem(last=False)
+
+
+def _generate_from_prompt(prompt, model_name, regenerate=False):
     """
-    Conecta na API do Gemini e solicita o HTML para o tema.
-    (ATUALIZADO com Engenharia de Prompt Condicional)
+    Faz UMA chamada ao Gemini (com cache). Retorna o HTML limpo ou None.
+    'regenerate=True' ignora o cache (o usuário pediu uma nova versão) e
+    guarda a resposta nova no lugar da anterior.
     """
+    key = _cache_key(model_name, prompt)
+    cached = None if regenerate else _cache_get(key)
+    if cached is not None:
+        print(f"[Core_Logic] HTML encontrado no cache. Pulando chamada à API.")
+        return cached
+
     try:
-        genai.configure(api_key=api_key)
         model = genai.GenerativeModel(model_name)
-        
-        # --- LÓGICA CONDICIONAL DA LOGO (Seu pedido) ---
-        # Começa com uma instrução vazia
-        logo_instruction = ""
-        if logo_url and logo_url.strip(): # Verifica se a string não é vazia
-            # Se uma URL foi fornecida, adiciona a instrução
-            logo_instruction = f"2. O e-mail DEVE incluir uma logo. Use esta URL: {logo_url}"
-        else:
-            # Se a URL estiver vazia, instrui a IA a NÃO usar uma.
-            logo_instruction = "2. O e-mail NÃO DEVE incluir uma logo nem espaço para ela."
-        # --- FIM DA LÓGICA CONDICIONAL ---
-
-        # --- LÓGICA DO ANO VIGENTE ---
-        ano_vigente = datetime.datetime.now().year
 
-        # --- PROMPT INTELIGENTE FINAL ---
-        prompt = (
-            f"Crie um e-mail marketing em HTML completo (inline CSS) sobre o tema: '{email_theme}'.\n"
-            f"O e-mail deve ser profissional e amigável.\n"
-            
-            # --- INSTRUÇÕES OBRIGATÓRIAS (Suas features) ---
-            f"1. O botão principal de Call-to-Action (CTA) DEVE apontar para esta URL: {cta_url}\n"
-            f"{logo_instruction}\n"
-            f"3. O nome da empresa é: '{company_name}'. Use-o no rodapé.\n"
-            f"4. O ano de copyright no rodapé DEVE ser o ano vigente: {ano_vigente}.\n"
-            
-            # --- PLACEHOLDERS PADRÃO ---
-            f"Use o placeholder [NOME] onde o nome do cliente deve ir.\n"
-            f"Coloque o código HTML final dentro de um bloco de código Markdown (```html ... ```)."
-        )
-        
         print(f"[Core_Logic] Enviando prompt para Gemini API...")
         # print(prompt) # Descomente esta linha se quiser ver o prompt final no console
-        
+
         request_options = {'timeout': 30}
         response = model.generate_content(prompt, request_options=request_options)
-        
+
         print(f"[Core_Logic] Resposta recebida. Limpando HTML...")
         cleaned_html = _clean_html_response(response.text)
-             
+
+        if cleaned_html:
+            _cache_set(key, cleaned_html)
         return cleaned_html
-    
+
     except Exception as e:
         print(f"Erro ao chamar a API do Gemini (pode ser TIMEOUT): {e}")
         return None
 
+
+def generate_ai_html(api_key, email_theme, cta_url, company_name, logo_url, model_name='gemini-2.5-flash-lite',
+                     extra_placeholders=None, regenerate=False):
+    """
+    Conecta na API do Gemini e solicita o HTML para o tema.
+    (ATUALIZADO com Engenharia de Prompt Condicional)
+    """
+    try:
+        genai.configure(api_key=api_key)
+        prompt = _build_prompt(email_theme, cta_url, company_name, logo_url,
+                               extra_placeholders=extra_placeholders)
+        return _generate_from_prompt(prompt, model_name, regenerate)
+
+    except Exception as e:
+        print(f"Erro ao chamar a API do Gemini (pode ser TIMEOUT): {e}")
+        return None
+
+
+MAX_VARIANTS = 5
+
+
+def generate_ai_html_variants(api_key, email_theme, cta_url, company_name, logo_url,
+                              num_variants=2, model_name='gemini-2.5-flash-lite', extra_placeholders=None,
+                              regenerate=False):
+    """
+    Gera N variações de HTML (Teste A/B) em PARALELO.
+    As chamadas ao Gemini são I/O (rede), então um pool de threads limitado
+    faz o tempo total ficar próximo de UMA chamada, e não de N.
+    Retorna a lista de HTMLs gerados (variações que falharam são descartadas:
+    quem chama compara o tamanho da lista com o que pediu).
+    """
+    num_variants = max(1, min(int(num_variants), MAX_VARIANTS))
+    try:
+        genai.configure(api_key=api_key)
+    except Exception as e:
+        print(f"Erro ao configurar a API do Gemini: {e}")
+        return []
+
+    prompts = [
+        _build_prompt(email_theme, cta_url, company_name, logo_url, i, num_variants, extra_placeholders)
+        for i in range(num_variants)
+    ]
+
+    print(f"[Core_Logic] Gerando {num_variants} variações em paralelo...")
+    with ThreadPoolExecutor(max_workers=num_variants) as executor:
+        results = list(executor.map(lambda p: _generate_from_prompt(p, model_name, regenerate), prompts))
+
+    variants = [html for html in results if html]
+    if len(variants) < num_variants:
+        print(f"[Core_Logic] Aviso: {num_variants - len(variants)} variações falharam.")
+    return variants
+
+# --- Geração em Streaming (prévia progressiva) ---
+
+class _FenceStripper:
+    """
+    Remove a cerca Markdown (```html ... ```) de um texto que chega em pedaços.
+    Enquanto não sabemos onde o HTML começa, o texto fica no buffer; depois
+    disso, cada pedaço é liberado na hora (menos os últimos caracteres, que
+    podem ser o começo da cerca de fechamento).
+    """
+    MAX_PREAMBLE = 2000 # Se não achar cerca nem '<' até aqui, libera tudo
+
+    def __init__(self):
+        self._buffer = ''
+        self._in_body = False
+        self._done = False
+
+    def feed(self, chunk):
+        if self._done or not chunk:
+            return ''
+        self._buffer += chunk
+
+        if not self._in_body:
+            stripped = self._buffer.lstrip()
+            fence = self._buffer.find('```')
+            if fence != -1:
+                newline = self._buffer.find('\n', fence)
+                if newline == -1:
+                    return '' # Ainda chegando a linha "```html"
+                self._buffer = self._buffer[newline + 1:]
+            elif stripped.startswith('<') or len(self._buffer) > self.MAX_PREAMBLE:
+                self._buffer = stripped
+            else:
+                return ''
+            self._in_body = True
+
+        end = self._buffer.find('```')
+        if end != -1:
+            out = self._buffer[:end]
+            self._buffer = ''
+            self._done = True
+            return out
+
+        # Segura até 2 caracteres: podem ser o começo de um ``` de fechamento
+        keep = len(self._buffer) - len(self._buffer.rstrip('`'))
+        out = self._buffer[:len(self._buffer) - keep]
+        self._buffer = self._buffer[len(out):]
+        return out
+
+    def finish(self):
+        out = '' if self._done else self._buffer.rstrip('`')
+        self._buffer = ''
+        self._done = True
+        return out
+
+
+def stream_ai_html(api_key, email_theme, cta_url, company_name, logo_url, model_name='gemini-2.5-flash-lite',
+                   extra_placeholders=None, regenerate=False):
+    """
+    Versão em streaming do generate_ai_html.
+    É um gerador de eventos: ('chunk', html_parcial) conforme a IA responde e,
+    no fim, ('done', html_final) ou ('error', mensagem). O HTML final passa
+    pelo _clean_html_response (igual ao modo normal) e vai para o cache.
+    'regenerate=True' ignora o cache, como no _generate_from_prompt.
+    """
+    try:
+        genai.configure(api_key=api_key)
+        prompt = _build_prompt(email_theme, cta_url, company_name, logo_url,
+                               extra_placeholders=extra_placeholders)
+        key = _cache_key(model_name, prompt)
+        cached = None if regenerate else _cache_get(key)
+        if cached is not None:
+            print(f"[Core_Logic] HTML encontrado no cache. Pulando chamada à API.")
+            yield ('done', cached)
+            return
+
+        model = genai.GenerativeModel(model_name)
+        print(f"[Core_Logic] Enviando prompt para Gemini API (streaming)...")
+        request_options = {'timeout': 30}
+        response = model.generate_content(prompt, stream=True, request_options=request_options)
+
+        stripper = _FenceStripper()
+        raw_parts = []
+        for chunk in response:
+            text = chunk.text or ''
+            raw_parts.append(text)
+            partial = stripper.feed(text)
+            if partial:
+                yield ('chunk', partial)
+        tail = stripper.finish()
+        if tail:
+            yield ('chunk', tail)
+
+        print(f"[Core_Logic] Streaming concluído. Limpando HTML...")
+        cleaned_html = _clean_html_response(''.join(raw_parts))
+        if not cleaned_html:
+            yield ('error', 'A IA retornou uma resposta vazia.')
+            return
+        _cache_set(key, cleaned_html)
+        yield ('done', cleaned_html)
+
+    except Exception as e:
+        print(f"Erro ao chamar a API do Gemini em streaming (pode ser TIMEOUT): {e}")
+        yield ('error', str(e))
+
+
+# --- Compactação do HTML (menos bytes por mensagem) ---
+
+# Tags de bloco/tabela: espaços entre elas não aparecem na renderização
+_BLOCK_TAGS = {
+    'html', 'head', 'body', 'meta', 'title', 'link', 'style', 'table', 'thead', 'tbody',
+    'tfoot', 'tr', 'td', 'th', 'div', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol',
+    'li', 'center', 'br', 'hr', 'section', 'header', 'footer', 'article', 'nav', 'main',
+    'blockquote', 'form', 'caption', 'colgroup', 'col',
+}
+# Conteúdo preservado como está (o espaço em branco importa)
+_PRESERVE_RE = re.compile(r'(<(pre|textarea|script)\b.*?</\2\s*>)', re.S | re.I)
+_STYLE_BLOCK_RE = re.compile(r'(<style\b[^>]*>)(.*?)(</style\s*>)', re.S | re.I)
+# Comentários comuns. Mantém os condicionais do Outlook e o bloco "downlevel-revealed":
+# não começa em '<!--[if', '<!--<!' nem '<!-->', e não atravessa um '<![endif]'
+_COMMENT_RE = re.compile(r'<!--(?!\[if|<!|>)(?:(?!<!\[endif\]|-->).)*-->', re.S)
+_TAG_RE = re.compile(r'(<[^>]+>)')
+_TAG_NAME_RE = re.compile(r'<\s*/?\s*([a-zA-Z0-9]+)')
+_STYLE_ATTR_RE = re.compile(r'(\sstyle\s*=\s*)(["\'])(.*?)\2', re.S | re.I)
+_ENTITY_RE = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);')
+
+
+def _split_css_declarations(style):
+    """
+    Divide 'a:b; c:d' em declarações, respeitando parênteses e aspas (ex: url(...;...)).
+    Entidades HTML (&quot;, &#39;, ...) são tratadas como um caractere só: o ';'
+    delas não separa declarações, e as de aspas abrem/fecham aspas como no navegador.
+    Retorna None se o texto não fechar aspas/parênteses (não dá para dividir com segurança).
+    """
+    parts, current, depth, quote = [], [], 0, None
+    pos = 0
+    while pos < len(style):
+        entity = _ENTITY_RE.match(style, pos)
+        if entity:
+            token = entity.group(0)
+            decoded = html_lib.unescape(token)
+            char = decoded if len(decoded) == 1 else ''
+        else:
+            token = char = style[pos]
+        pos += len(token)
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ('"', "'"):
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(0, depth - 1)
+        elif char == ';' and depth == 0 and not entity:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(token)
+    if quote or depth:
+        return None
+    parts.append(''.join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _compact_style_attr(style):
+    """
+    Normaliza um atributo style inline e remove declarações repetidas.
+    Só remove cópias IDÊNTICAS (mesma propriedade e mesmo valor): pares como
+    'background:#fff;background:linear-gradient(...)' são fallbacks para
+    clientes que não entendem o segundo valor e ficam como estão.
+    Se alguma parte não for 'propriedade:valor', o atributo volta sem alteração.
+    """
+    parts = _split_css_declarations(style)
+    if parts is None:
+        return style
+    declarations = {}
+    for declaration in parts:
+        prop, sep, value = declaration.partition(':')
+        if not sep or not prop.strip():
+            return style
+        key = (prop.strip().lower(), re.sub(r'\s+', ' ', value.strip()))
+        declarations.pop(key, None) # Reinsere no fim (posição da última cópia)
+        declarations[key] = True
+    return ';'.join(f'{prop}:{value}' for prop, value in declarations)
+
+
+def _compact_css_block(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    return re.sub(r'\s*([{};])\s*', r'\1', css).strip()
+
+
+def _tag_name(tag):
+    match = _TAG_NAME_RE.match(tag)
+    return match.group(1).lower() if match else ''
+
+
+def _compact_fragment(html):
+    """Compacta um trecho sem <pre>/<textarea>/<script>."""
+    html = _COMMENT_RE.sub('', html)
+    html = _STYLE_BLOCK_RE.sub(lambda m: m.group(1) + _compact_css_block(m.group(2)) + m.group(3), html)
+    html = _STYLE_ATTR_RE.sub(lambda m: f'{m.group(1)}{m.group(2)}{_compact_style_attr(m.group(3))}{m.group(2)}', html)
+
+    tokens = _TAG_RE.split(html)
+    out = []
+    for i, token in enumerate(tokens):
+        if i % 2 == 1: # Tag
+            out.append(re.sub(r'\s+', ' ', token))
+            continue
+        if not token:
+            continue
+        text = re.sub(r'\s+', ' ', token)
+        prev_block = i > 0 and _tag_name(tokens[i - 1]) in _BLOCK_TAGS
+        next_block = i + 1 < len(tokens) and _tag_name(tokens[i + 1]) in _BLOCK_TAGS
+        if prev_block or i == 0:
+            text = text.lstrip()
+        if next_block or i == len(tokens) - 1:
+            text = text.rstrip()
+        out.append(text)
+    return ''.join(out)
+
+
+def compact_html(html):
+    """
+    Etapa de pós-processamento (depois do _clean_html_response): remove
+    comentários, espaços/indentação desnecessários e propriedades repetidas
+    nos style inline, sem mudar a renderização. Retorna o HTML compactado.
+    """
+    if not html:
+        return html
+    pieces = _PRESERVE_RE.split(html)
+    out = []
+    # O split com 2 grupos devolve: [texto, bloco, nome_da_tag, texto, ...]
+    for i in range(0, len(pieces), 3):
+        out.append(_compact_fragment(pieces[i]))
+        if i + 1 < len(pieces):
+            out.append(pieces[i + 1])
+    return ''.join(out)
+
+
 # --- Lógica de Leads ---
 
+def placeholder_name(column):
+    """Converte o nome de uma coluna do CSV no placeholder usado no HTML (ex: 'nome empresa' -> 'NOME_EMPRESA')."""
+    return re.sub(r'[^A-Z0-9]+', '_', str(column).strip().upper()).strip('_')
+
+
+def get_lead_field_columns(df):
+    """Retorna as colunas extras do CSV (além de 'nome' e 'email') que viram placeholders."""
+    return [col for col in df.columns if col not in ('nome', 'email') and placeholder_name(col)]
+
+
 def get_leads(csv_file_path):
     """
     Lê o arquivo CSV (salvo temporariamente) e retorna um DataFrame limpo.
+    Todas as colunas são mantidas (como texto) para uso na personalização.
     """
     try:
-        df = pd.read_csv(csv_file_path)
+        df = pd.read_csv(csv_file_path, dtype=str)
+        df.columns = [str(col).strip() for col in df.columns]
         if "email" not in df.columns or "nome" not in df.columns:
             print(f"Erro: O arquivo CSV deve conter as colunas 'nome' e 'email'.")
             return None
@@ -105,6 +473,8 @@ def get_leads(csv_file_path):
         if not df.empty:
             df['nome'] = df['nome'].astype(str)
             df['email'] = df['email'].astype(str)
+            extra_columns = get_lead_field_columns(df)
+            df[extra_columns] = df[extra_columns].fillna('')
             
         return df
     
@@ -112,21 +482,160 @@ def get_leads(csv_file_path):
         print(f"Erro ao ler o CSV: {e}")
         return None
 
+# --- Lógica de Personalização ---
+
+_PLACEHOLDER_RE = re.compile(r'\[([A-Z0-9_]+)\]')
+
+
+class EmailTemplate:
+    """
+    HTML "compilado" uma única vez por campanha.
+    O texto é quebrado em pedaços literais + nomes de placeholders, então
+    personalizar cada destinatário é só um join (sem varrer o HTML de novo).
+    Placeholders desconhecidos (fora de 'field_names') ficam como texto literal.
+    """
+
+    def __init__(self, html, field_names=()):
+        known = {'NOME', 'EMAIL'} | set(field_names)
+        self.html = html
+        self._literals = []
+        self._keys = []
+        last = 0
+        for match in _PLACEHOLDER_RE.finditer(html):
+            if match.group(1) not in known:
+                continue
+            self._literals.append(html[last:match.start()])
+            self._keys.append(match.group(1))
+            last = match.end()
+        self._literals.append(html[last:])
+
+    @property
+    def placeholders(self):
+        return set(self._keys)
+
+    def render(self, fields):
+        """Substitui os placeholders pelos valores de 'fields' (dict placeholder -> valor)."""
+        if not self._keys:
+            return self.html
+        literals = self._literals
+        parts = [literals[0]]
+        for i, key in enumerate(self._keys, start=1):
+            parts.append(fields.get(key, ''))
+            parts.append(literals[i])
+        return ''.join(parts)
+
+
+def compile_template(html, field_names=()):
+    """Compila o HTML da campanha para personalização rápida."""
+    return EmailTemplate(html or '', field_names)
+
+
+def build_recipient_fields(nome, email, field_names=(), field_values=None):
+    """
+    Monta o dict de placeholders de um destinatário.
+    [NOME] continua sendo apenas o primeiro nome (comportamento original).
+    """
+    fields = {'NOME': nome.split(" ")[0] if nome else '', 'EMAIL': email or ''}
+    if field_values:
+        fields.update(zip(field_names, field_values))
+    return fields
+
+
 # --- Lógica de Envio ---
 
-def send_email(smtp_config, to_name, to_email, subject, html_body):
+class DeliveryResult:
+    """
+    Resultado de um envio. Avalia como True/False (compatível com o antigo
+    'return True/False'), mas também diz se a falha é TRANSITÓRIA (vale
+    tentar de novo) ou PERMANENTE, e qual foi o código SMTP.
+    """
+
+    def __init__(self, ok, transient=False, code=None, error=None, relay=None, relay_fault=False):
+        self.ok = ok
+        self.transient = transient
+        self.code = code
+        self.error = error
+        self.relay = relay # Nome do relay SMTP usado (quando houver vários)
+        self.relay_fault = relay_fault # Falha do servidor/conta SMTP (não do destinatário)
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return f'<DeliveryResult ok={self.ok} transient={self.transient} code={self.code}>'
+
+
+def classify_smtp_error(exc):
     """
-    Envia um único e-mail.
+    Classifica uma exceção de envio pelo código de resposta SMTP.
+    Retorna (transient, code): respostas 4xx e erros de rede/timeout são
+    transitórios; respostas 5xx (e erros desconhecidos) são permanentes.
+    """
+    code = None
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [reply[0] for reply in exc.recipients.values()]
+        code = codes[0] if codes else None
+    elif isinstance(exc, smtplib.SMTPResponseException):
+        code = exc.smtp_code
+
+    if code is not None:
+        return 400 <= code < 500, code
+
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True, None
+    if isinstance(exc, smtplib.SMTPException):
+        return False, None
+    if isinstance(exc, (socket.timeout, ConnectionError, OSError)):
+        return True, None
+
+    return False, None
+
+
+# Respostas que indicam problema de credenciais do RELAY (não do destinatário)
+SMTP_AUTH_FAULT_CODES = (530, 534, 535)
+
+
+def is_relay_fault(exc):
+    """
+    True se a falha é do servidor/conta SMTP (conexão, desconexão, login),
+    ou seja, outro relay pode entregar a mesma mensagem. Respostas 4xx/5xx
+    sobre o remetente ou o destinatário (ex: 450 greylisting, 452 caixa cheia)
+    NÃO são falhas do relay.
+    """
+    if isinstance(exc, (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected,
+                        smtplib.SMTPAuthenticationError)):
+        return True
+    if isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code in SMTP_AUTH_FAULT_CODES:
+        return True
+    if isinstance(exc, smtplib.SMTPException):
+        return False
+    # Erros de rede/timeout (socket)
+    return isinstance(exc, (socket.timeout, ConnectionError, OSError))
+
+
+def build_message(from_addr, to_email, subject, html):
+    """Monta a mensagem MIME (já personalizada) de um destinatário."""
+    msg = MIMEMultipart()
+    msg['From'] = from_addr
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(html, 'html'))
+    return msg
+
+
+def send_email(smtp_config, to_name, to_email, subject, html_body, fields=None):
+    """
+    Envia um único e-mail e retorna um DeliveryResult.
     Recebe 'smtp_config' (um dict com server, port, user, pass) como argumento.
+    'html_body' pode ser o HTML (str) ou um EmailTemplate já compilado;
+    'fields' é o dict de placeholders do destinatário (padrão: só [NOME]/[EMAIL]).
     """
     try:
-        msg = MIMEMultipart()
-        msg['From'] = smtp_config['user']
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        personalized_body = html_body.replace("[NOME]", to_name.split(" ")[0]) 
-        msg.attach(MIMEText(personalized_body, 'html'))
+        if not isinstance(html_body, EmailTemplate):
+            html_body = compile_template(html_body)
+        if fields is None:
+            fields = build_recipient_fields(to_name, to_email)
+        msg = build_message(smtp_config['user'], to_email, subject, html_body.render(fields))
 
         print(f"[Core_Logic] Conectando ao SMTP {smtp_config['server']}...")
         server = smtplib.SMTP(smtp_config['server'], int(smtp_config['port']))
@@ -138,8 +647,10 @@ def send_email(smtp_config, to_name, to_email, subject, html_body):
         server.quit()
         
         print(f"[Core_Logic] E-mail enviado com sucesso para {to_email}.")
-        return True
+        return DeliveryResult(True)
     
     except Exception as e:
-        print(f"Erro ao enviar e-mail (SMTP) para {to_email}: {e}")
-        return False
\ No newline at end of file
+        transient, code = classify_smtp_error(e)
+        print(f"Erro ao enviar e-mail (SMTP) para {to_email} ({'transitório' if transient else 'permanente'}): {e}")
+        return DeliveryResult(False, transient=transient, code=code, error=str(e),
+                              relay_fault=is_relay_fault(e))
\ No newline at end of file
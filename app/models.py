@@ -16,6 +16,65 @@ class Settings(db.Model):
     def __repr__(self):
         return f'<Setting {self.key}>'
 
+class SmtpRelay(db.Model):
+    """
+    Relay SMTP (conta de envio). O worker divide as mensagens entre os relays
+    ativos pelo peso, respeitando o limite por minuto de cada um, e tira do
+    rodízio (por um tempo) o relay que falhar seguidamente.
+    Sem nenhum relay cadastrado, vale o SMTP_* das Configurações.
+    """
+    __tablename__ = 'smtp_relay'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    server = db.Column(db.String(200), nullable=False)
+    port = db.Column(db.Integer, nullable=False, default=587)
+    user = db.Column(db.String(200), nullable=False)
+    password = db.Column(db.String(500), nullable=False)
+    weight = db.Column(db.Integer, nullable=False, default=1) # Peso no rodízio (2 = o dobro de mensagens)
+    rate_limit = db.Column(db.Integer, nullable=True) # Mensagens por minuto (vazio = sem limite)
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    # Estatísticas (somadas por todos os processos do worker)
+    sent_count = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    consecutive_failures = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(500), nullable=True)
+    last_used_at = db.Column(db.DateTime, nullable=True)
+    disabled_until = db.Column(db.DateTime, nullable=True) # Fora do rodízio até esta data (UTC)
+
+    @property
+    def config(self):
+        """Dict no formato esperado por core_logic.send_email."""
+        return {'server': self.server, 'port': self.port, 'user': self.user, 'pass': self.password}
+
+    @property
+    def error_rate(self):
+        """Percentual de envios com erro (None se o relay ainda não foi usado)."""
+        total = (self.sent_count or 0) + (self.error_count or 0)
+        return round(100.0 * (self.error_count or 0) / total, 1) if total else None
+
+    @property
+    def is_healthy(self):
+        return self.disabled_until is None or self.disabled_until <= datetime.datetime.utcnow()
+
+    def __repr__(self):
+        return f'<SmtpRelay {self.name}>'
+
+class HtmlBlob(db.Model):
+    """
+    HTML de campanhas/variações, endereçado pelo conteúdo (SHA-256) e
+    compactado com zlib. HTMLs iguais são gravados uma única vez.
+    """
+    __tablename__ = 'html_blob'
+    hash = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False) # zlib
+    size = db.Column(db.Integer, nullable=False) # Bytes do HTML original (sem compressão)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<HtmlBlob {self.hash[:12]} ({self.size} bytes)>'
+
 class Campaign(db.Model):
     """
     Tabela para o Histórico de Campanhas.
@@ -28,39 +87,178 @@ class Campaign(db.Model):
     # nullable=False significa que é um campo obrigatório
     cta_url = db.Column(db.String(500), nullable=False, default='https://example.com')
     # --- FIM DA NOVA LINHA ---
-    generated_html = db.Column(db.Text, nullable=True)
+    # HTML guardado fora da tabela (HtmlBlob), só o hash fica aqui: ver 'generated_html'
+    html_hash = db.Column(db.String(64), db.ForeignKey('html_blob.hash'), nullable=True, index=True)
     status = db.Column(db.String(100), nullable=False, default='Pendente') # Ex: Pendente, Gerando, Enviando, Concluído
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     user = db.relationship('User', backref='campaigns')
-    generated_html = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
     # --- NOVO: ID da tarefa no Redis (para poder cancelar depois) ---
     job_id = db.Column(db.String(100), nullable=True)
 
+    # Tamanho do HTML por mensagem (soma das variações) antes/depois da compactação
+    html_bytes_original = db.Column(db.Integer, nullable=True)
+    html_bytes_compact = db.Column(db.Integer, nullable=True)
+
+    # Lista de leads usada no envio e cópia dos seus placeholders extras
+    # no momento do envio (ex: ["CIDADE", "EMPRESA"]); os valores ficam em Contact.fields.
+    lead_list_id = db.Column(db.Integer, db.ForeignKey('lead_list.id'), nullable=True, index=True)
+    lead_fields = db.Column(db.JSON, nullable=True)
+
     # Guarda a data agendada (pode ser nula se for envio imediato)
     scheduled_at = db.Column(db.DateTime, nullable=True)
+    # Fim do envio (base para o arquivamento)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    # Arquivamento: os destinatários saem da tabela 'recipient' para um arquivo
+    # compactado (app/archive.py); no banco ficam só os totais por status
+    archived_at = db.Column(db.DateTime, nullable=True)
+    archive_counts = db.Column(db.JSON, nullable=True) # Ex: {"Enviado": 950, "Falhou": 50}
     
     # Relacionamento: Uma campanha tem muitos destinatários
     recipients = db.relationship('Recipient', backref='campaign', lazy=True, cascade="all, delete-orphan")
 
+    # Variações de HTML (Teste A/B). Vazio = campanha com um único HTML (generated_html)
+    variants = db.relationship('CampaignVariant', backref='campaign', lazy=True,
+                               order_by='CampaignVariant.index', cascade="all, delete-orphan")
+
+    @property
+    def generated_html(self):
+        from app import blobs
+        return blobs.get_html(self.html_hash)
+
+    @generated_html.setter
+    def generated_html(self, html):
+        from app import blobs
+        self.html_hash = blobs.put_html(html) if html else None
+
+    @property
+    def is_archived(self):
+        return self.archived_at is not None
+
+    @property
+    def recipient_count(self):
+        """Total de destinatários (dos totais arquivados, se a campanha foi arquivada)."""
+        if self.is_archived:
+            return sum((self.archive_counts or {}).values())
+        return Recipient.query.filter_by(campaign_id=self.id).count()
+
+    @property
+    def html_bytes_saved(self):
+        """Bytes economizados por mensagem (média entre as variações)."""
+        if self.html_bytes_original is None or self.html_bytes_compact is None:
+            return None
+        return (self.html_bytes_original - self.html_bytes_compact) // max(len(self.variants), 1)
+
     def __repr__(self):
         return f'<Campaign {self.subject}>'
 
+class CampaignVariant(db.Model):
+    """
+    Tabela para as variações de HTML de uma campanha (Teste A/B).
+    Os destinatários são divididos entre as variações pelo campo Recipient.variant.
+    """
+    __tablename__ = 'campaign_variant'
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=False, index=True)
+    index = db.Column(db.Integer, nullable=False, default=0) # 0 = A, 1 = B, ...
+    html_hash = db.Column(db.String(64), db.ForeignKey('html_blob.hash'), nullable=False, index=True)
+
+    @property
+    def html(self):
+        from app import blobs
+        return blobs.get_html(self.html_hash)
+
+    @html.setter
+    def html(self, html):
+        from app import blobs
+        self.html_hash = blobs.put_html(html)
+
+    @property
+    def label(self):
+        return chr(ord('A') + self.index)
+
+    def __repr__(self):
+        return f'<CampaignVariant {self.label} (Campaign {self.campaign_id})>'
+
+class Contact(db.Model):
+    """
+    Cadastro permanente de contatos (reaproveitado entre listas e campanhas).
+    O e-mail é guardado normalizado (minúsculo, sem espaços) e é único.
+    """
+    __tablename__ = 'contact'
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(200), unique=True, index=True, nullable=False)
+    nome = db.Column(db.String(200), nullable=False)
+    # Colunas extras do CSV como {"CIDADE": "Recife", ...} (acumula entre importações)
+    fields = db.Column(db.JSON, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Contact {self.email}>'
+
+class LeadList(db.Model):
+    """
+    Lista de leads nomeada. As campanhas apontam para a lista em vez de
+    copiar o CSV; reimportar a lista só grava os contatos que mudaram.
+    """
+    __tablename__ = 'lead_list'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), unique=True, nullable=False)
+    # Placeholders extras da lista (ex: ["CIDADE", "EMPRESA"])
+    field_names = db.Column(db.JSON, nullable=True)
+    contact_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    user = db.relationship('User', backref='lead_lists')
+
+    campaigns = db.relationship('Campaign', backref='lead_list', lazy=True)
+
+    def __repr__(self):
+        return f'<LeadList {self.name}>'
+
+class LeadListMember(db.Model):
+    """Associação lista <-> contato (uma linha por contato da lista)."""
+    __tablename__ = 'lead_list_member'
+    list_id = db.Column(db.Integer, db.ForeignKey('lead_list.id'), primary_key=True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), primary_key=True, index=True)
+
 class Recipient(db.Model):
     """
-    Tabela para armazenar cada destinatário de uma campanha.
+    Estado de entrega de cada contato em uma campanha.
+    Tabela leve: nome, e-mail e campos extras ficam no Contact.
     """
     __tablename__ = 'recipient'
     id = db.Column(db.Integer, primary_key=True)
-    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=False)
-    nome = db.Column(db.String(200), nullable=False)
-    email = db.Column(db.String(200), nullable=False)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=False, index=True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=False, index=True)
     status = db.Column(db.String(100), nullable=False, default='Na Fila') # Ex: Na Fila, Enviado, Falhou
+    variant = db.Column(db.Integer, nullable=False, default=0) # Índice da CampaignVariant recebida
+
+    # Reenvio automático: nº de tentativas e histórico [{at, ok, code, error}, ...]
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    attempt_history = db.Column(db.JSON, nullable=True)
+
+    # Carregado no MESMO SELECT do destinatário (sem uma query por contato)
+    contact = db.relationship('Contact', lazy='joined')
+
+    @property
+    def nome(self):
+        return self.contact.nome
+
+    @property
+    def email(self):
+        return self.contact.email
+
+    def field_values(self, field_names):
+        """Valores dos placeholders extras, na ordem de 'field_names'."""
+        fields = self.contact.fields or {}
+        return [fields.get(name, '') for name in field_names]
 
     def __repr__(self):
-        return f'<Recipient {self.email} (Campaign {self.campaign_id})>'
+        return f'<Recipient {self.contact_id} (Campaign {self.campaign_id})>'
 
 class User(UserMixin, db.Model):
     """
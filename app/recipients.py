@@ -0,0 +1,44 @@
+"""
+Leitura dos destinatários de uma campanha em lotes por "keyset" (id > último id).
+Usado pelo worker (objetos Recipient), pela exportação CSV e pelo arquivamento
+(só as colunas necessárias, sem objetos ORM): a memória fica constante, seja a
+campanha de 1 mil ou de 1 milhão de linhas.
+"""
+from app import db
+from app.models import Contact, Recipient
+
+RECIPIENT_BATCH_SIZE = 5000
+
+# Colunas de cada linha de iter_recipient_rows (os dados do contato vêm pelo join)
+RECIPIENT_ROW_COLUMNS = (Recipient.id, Contact.nome, Contact.email, Recipient.status,
+                         Recipient.variant, Recipient.attempts, Contact.fields)
+
+
+def iter_keyset_batches(stmt, key_column, batch_size, scalars=False):
+    """
+    Executa 'stmt' em lotes ordenados por 'key_column' (crescente), continuando
+    a partir da última chave lida. Com scalars=True, cada lote é uma lista de
+    objetos ORM (ex: select(Recipient)); senão, de linhas.
+    """
+    last_key = 0
+    while True:
+        page = stmt.where(key_column > last_key).order_by(key_column).limit(batch_size)
+        batch = db.session.scalars(page).all() if scalars else db.session.execute(page).all()
+        if not batch:
+            return
+        last_key = getattr(batch[-1], key_column.key)
+        yield batch
+
+
+def iter_recipient_rows(campaign_id, extra_columns=(), batch_size=RECIPIENT_BATCH_SIZE):
+    """
+    Destinatários da campanha com os dados do contato NESTE momento, uma linha
+    por vez (RECIPIENT_ROW_COLUMNS + 'extra_columns', ex: Recipient.contact_id).
+    """
+    stmt = (
+        db.select(*RECIPIENT_ROW_COLUMNS, *extra_columns)
+        .join(Contact, Recipient.contact_id == Contact.id)
+        .where(Recipient.campaign_id == campaign_id)
+    )
+    for batch in iter_keyset_batches(stmt, Recipient.id, batch_size):
+        yield from batch
@@ -0,0 +1,239 @@
+"""
+Balanceamento do envio entre vários relays SMTP.
+Cada mensagem vai para um relay sorteado pelo peso, respeitando o limite
+por minuto de cada um (contador compartilhado no Redis). Se o relay falhar
+por um motivo dele (conexão, desconexão, autenticação), a MESMA mensagem é
+tentada no próximo relay; após falhas seguidas ele sai do rodízio por um
+tempo. Recusas sobre o destinatário/remetente (ex: 450 greylisting) vão
+direto para a fila de reenvio, sem failover.
+"""
+import datetime
+import random
+import time
+
+from flask import current_app
+from sqlalchemy import update, or_
+
+from app import db
+from app import core_logic
+from app import task_queue
+from app.models import Settings, SmtpRelay
+
+RATE_WINDOW = 60 # segundos (rate_limit = mensagens por minuto)
+
+
+def rate_key(relay_id):
+    """Chave do contador por minuto de um relay no Redis."""
+    return f'smtp_relay:{relay_id}'
+
+
+class _RelayState:
+    """Estado de um relay dentro do processo (saúde, janela de limite e estatísticas pendentes)."""
+
+    def __init__(self, relay_id, name, config, weight=1, rate_limit=None, failures=0, down_until=None):
+        self.id = relay_id
+        self.name = name
+        self.config = config
+        self.weight = max(weight or 1, 1)
+        self.rate_limit = rate_limit
+        self.failures = failures
+        self.down_until = down_until # datetime UTC (circuito aberto)
+        self.saturated_until = 0.0   # time.monotonic() do fim da janela cheia
+        self.sent = 0
+        self.errors = 0
+        self.last_error = None
+        # Mudanças no circuito feitas POR ESTE processo desde o último flush
+        self.last_success_at = None # último envio OK (fecha o circuito)
+        self.new_failures = 0       # falhas do relay depois desse último envio OK
+        self.tripped_until = None   # circuito aberto aqui (até quando)
+        self.dirty = False
+
+
+class RelayPool:
+    """
+    Conjunto de relays usado por UMA tarefa do worker.
+    send() escolhe o relay, faz o failover e devolve o DeliveryResult;
+    flush_stats() grava os contadores no banco (chamar antes do commit do lote).
+    """
+
+    def __init__(self, relays, failure_threshold=3, cooldown=300):
+        self.relays = relays
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+    def __len__(self):
+        return len(self.relays)
+
+    def _acquire(self, relay):
+        """Reserva 1 envio na janela atual. False se o relay já atingiu o limite."""
+        if relay.id is None:
+            return True
+        try:
+            count, seconds_left = task_queue.incr_window(rate_key(relay.id), RATE_WINDOW)
+        except Exception as e:
+            # Sem Redis não há como contar: envia sem limite em vez de travar
+            print(f"[Relays] Aviso: contador de limite indisponível ({e}).")
+            return True
+        if relay.rate_limit and count > relay.rate_limit:
+            relay.saturated_until = time.monotonic() + seconds_left
+            return False
+        return True
+
+    def _choose(self, exclude):
+        """Sorteia (pelo peso) um relay saudável e com limite disponível; espera se todos estiverem no limite."""
+        while True:
+            now = datetime.datetime.utcnow()
+            healthy = [r for r in self.relays
+                       if r not in exclude and (r.down_until is None or r.down_until <= now)]
+            if not healthy:
+                return None
+            clock = time.monotonic()
+            candidates = [r for r in healthy if r.saturated_until <= clock]
+            if not candidates:
+                wait = min(r.saturated_until for r in healthy) - clock
+                print(f"[Relays] Todos os relays no limite por minuto. Aguardando {wait:.1f}s...")
+                time.sleep(max(wait, 0.1))
+                continue
+            relay = random.choices(candidates, weights=[r.weight for r in candidates])[0]
+            if self._acquire(relay):
+                return relay
+
+    def _record(self, relay, result):
+        relay.dirty = True
+        if result:
+            relay.sent += 1
+            relay.failures = 0
+            relay.new_failures = 0
+            relay.last_success_at = datetime.datetime.utcnow()
+            return
+        relay.errors += 1
+        relay.last_error = (result.error or '')[:500] or None
+        if result.relay_fault:
+            relay.failures += 1
+            relay.new_failures += 1
+            if relay.failures >= self.failure_threshold:
+                relay.down_until = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.cooldown)
+                relay.tripped_until = relay.down_until
+                print(f"[Relays] Relay '{relay.name}' fora do rodízio por {self.cooldown}s "
+                      f"({relay.failures} falhas seguidas).")
+
+    def send(self, to_name, to_email, subject, html_body, fields=None):
+        """Envia por um dos relays, com failover para os demais. Retorna o DeliveryResult."""
+        tried = []
+        result = None
+        while True:
+            relay = self._choose(tried)
+            if relay is None:
+                if result is None:
+                    return core_logic.DeliveryResult(False, transient=True,
+                                                     error='Nenhum relay SMTP disponível no momento.')
+                return result
+            tried.append(relay)
+            result = core_logic.send_email(relay.config, to_name, to_email, subject, html_body, fields=fields)
+            result.relay = relay.name
+            self._record(relay, result)
+            if result or not result.relay_fault:
+                return result
+            print(f"[Relays] Falha no relay '{relay.name}' para {to_email}. Tentando outro relay...")
+
+    def flush_stats(self):
+        """
+        Soma os contadores pendentes no banco (UPDATE atômico: vários processos podem gravar)
+        e relê a saúde dos relays, para ver o circuito aberto/fechado por outros processos.
+        O circuito só é gravado quando ESTE processo o abriu ou fechou, e sem desfazer
+        uma mudança mais recente de outro processo.
+        """
+        now = datetime.datetime.utcnow()
+        for relay in self.relays:
+            if relay.id is None or not relay.dirty:
+                continue
+            values = {
+                'sent_count': SmtpRelay.sent_count + relay.sent,
+                'error_count': SmtpRelay.error_count + relay.errors,
+                'last_used_at': now,
+            }
+            if relay.last_error:
+                values['last_error'] = relay.last_error
+            db.session.execute(update(SmtpRelay).where(SmtpRelay.id == relay.id).values(**values))
+
+            reset = None
+            if relay.last_success_at:
+                # Fecha o circuito só se ele foi aberto ANTES do nosso envio OK
+                # (disabled_until = abertura + cooldown)
+                opened_before = relay.last_success_at + datetime.timedelta(seconds=self.cooldown)
+                reset = db.session.execute(
+                    update(SmtpRelay)
+                    .where(SmtpRelay.id == relay.id,
+                           or_(SmtpRelay.disabled_until.is_(None), SmtpRelay.disabled_until < opened_before))
+                    .values(consecutive_failures=relay.new_failures, disabled_until=None)
+                )
+            if relay.new_failures and (reset is None or not reset.rowcount):
+                db.session.execute(
+                    update(SmtpRelay).where(SmtpRelay.id == relay.id)
+                    .values(consecutive_failures=SmtpRelay.consecutive_failures + relay.new_failures)
+                )
+            if relay.tripped_until:
+                db.session.execute(
+                    update(SmtpRelay)
+                    .where(SmtpRelay.id == relay.id,
+                           or_(SmtpRelay.disabled_until.is_(None), SmtpRelay.disabled_until < relay.tripped_until))
+                    .values(disabled_until=relay.tripped_until)
+                )
+            relay.sent = relay.errors = 0
+            relay.last_error = None
+            relay.last_success_at = None
+            relay.new_failures = 0
+            relay.tripped_until = None
+            relay.dirty = False
+        self._refresh_health()
+
+    def _refresh_health(self):
+        """Relê falhas seguidas e circuito de cada relay (gravados também por outros processos)."""
+        by_id = {relay.id: relay for relay in self.relays if relay.id is not None}
+        if not by_id:
+            return
+        rows = db.session.execute(
+            db.select(SmtpRelay.id, SmtpRelay.consecutive_failures, SmtpRelay.disabled_until)
+            .where(SmtpRelay.id.in_(list(by_id)))
+        )
+        for relay_id, failures, disabled_until in rows:
+            by_id[relay_id].failures = failures or 0
+            by_id[relay_id].down_until = disabled_until
+
+
+def _legacy_relay():
+    """Relay único das Configurações (SMTP_*), usado quando não há relays cadastrados."""
+    settings = {setting.key: setting.value for setting in Settings.query.all()}
+    config = {
+        'server': settings.get('SMTP_SERVER'),
+        'port': settings.get('SMTP_PORT'),
+        'user': settings.get('SMTP_USER'),
+        'pass': settings.get('SMTP_PASS')
+    }
+    if not all(config.values()):
+        return None
+    return _RelayState(None, 'Padrão (Configurações)', config)
+
+
+def load_pool():
+    """Monta o RelayPool com os relays ativos (ou o SMTP das Configurações). Vazio = sem SMTP configurado."""
+    relays = [
+        _RelayState(relay.id, relay.name, relay.config, relay.weight, relay.rate_limit,
+                    relay.consecutive_failures or 0, relay.disabled_until)
+        for relay in SmtpRelay.query.filter_by(is_active=True).order_by(SmtpRelay.id)
+    ]
+    if not relays:
+        legacy = _legacy_relay()
+        relays = [legacy] if legacy else []
+    return RelayPool(relays,
+                     failure_threshold=current_app.config.get('RELAY_FAILURE_THRESHOLD', 3),
+                     cooldown=current_app.config.get('RELAY_COOLDOWN', 300))
+
+
+def current_throughput(relays):
+    """Mensagens no minuto atual de cada relay ({id: n}); vazio se o Redis não responder."""
+    try:
+        return {relay.id: task_queue.window_count(rate_key(relay.id), RATE_WINDOW) for relay in relays}
+    except Exception as e:
+        print(f"[Relays] Aviso: não foi possível ler os contadores no Redis ({e}).")
+        return {}
@@ -1,19 +1,26 @@
 from flask import (
     Blueprint, render_template, request, flash, 
-    redirect, url_for, current_app, abort
+    redirect, url_for, jsonify,
+    Response, stream_with_context
 )
 from app import db
-from app.models import Settings, Campaign, Recipient, User
+from app.models import Settings, Campaign, CampaignVariant, Recipient, User, LeadList, LeadListMember, SmtpRelay
 from app import core_logic # <-- Importa nosso motor
+from app import task_queue # <-- Gateway único do Redis/RQ
+from app import contacts # <-- Cadastro de contatos / listas de leads
+from app import relays # <-- Relays SMTP (balanceamento/failover)
+from app import archive # <-- Destinatários de campanhas arquivadas
+from app import recipients # <-- Leitura dos destinatários em lotes (keyset)
 from flask_login import login_required, current_user
 import os
-import secrets # <-- Para gerar nomes de arquivo seguros
-import redis
-from rq import Queue
+import csv
+import json
+import io
+import zlib
+from types import SimpleNamespace
 from datetime import datetime
 import pytz
-from rq.job import Job
-from rq.exceptions import NoSuchJobError
+from sqlalchemy import insert, literal
 
 
 main_bp = Blueprint('main', __name__)
@@ -51,7 +58,93 @@ def admin():
         return redirect(url_for('main.admin'))
 
     settings_dict = get_settings_dict()
-    return render_template('admin.html', settings=settings_dict)
+    smtp_relays = SmtpRelay.query.order_by(SmtpRelay.id).all()
+    return render_template('admin.html', settings=settings_dict,
+                           smtp_relays=smtp_relays,
+                           relay_throughput=relays.current_throughput(smtp_relays),
+                           rate_window=relays.RATE_WINDOW)
+
+# --- RELAYS SMTP (vários servidores/contas de envio) ---
+
+@main_bp.route('/admin/relays', methods=['POST'])
+@login_required
+def save_relay():
+    """Cria um relay SMTP ou atualiza o relay de mesmo nome (senha em branco = mantém a atual)."""
+    if current_user.role != 'admin':
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('main.history'))
+
+    name = (request.form.get('name') or '').strip()
+    server = (request.form.get('server') or '').strip()
+    user = (request.form.get('user') or '').strip()
+    password = request.form.get('password') or ''
+    port = request.form.get('port', 587, type=int)
+    weight = request.form.get('weight', 1, type=int) or 1
+    rate_limit = request.form.get('rate_limit', type=int) or None
+
+    relay = SmtpRelay.query.filter_by(name=name).first()
+    if not all([name, server, user]) or (relay is None and not password):
+        flash('Nome, Servidor, Usuário e Senha do relay são obrigatórios.', 'error')
+        return redirect(url_for('main.admin'))
+
+    if relay is None:
+        relay = SmtpRelay(name=name)
+        db.session.add(relay)
+    relay.server = server
+    relay.port = port
+    relay.user = user
+    if password:
+        relay.password = password
+    relay.weight = max(weight, 1)
+    relay.rate_limit = rate_limit
+    db.session.commit()
+    flash(f'Relay {relay.name} salvo com sucesso!', 'success')
+    return redirect(url_for('main.admin'))
+
+@main_bp.route('/admin/relays/<int:relay_id>/toggle')
+@login_required
+def toggle_relay(relay_id):
+    if current_user.role != 'admin': return redirect(url_for('main.history'))
+
+    relay = db.session.get(SmtpRelay, relay_id)
+    if relay:
+        relay.is_active = not relay.is_active # Inverte o status
+        db.session.commit()
+        status = "ativado" if relay.is_active else "desativado"
+        flash(f'Relay {relay.name} foi {status}.', 'success')
+
+    return redirect(url_for('main.admin'))
+
+@main_bp.route('/admin/relays/<int:relay_id>/reset')
+@login_required
+def reset_relay(relay_id):
+    """Zera as estatísticas e devolve o relay ao rodízio."""
+    if current_user.role != 'admin': return redirect(url_for('main.history'))
+
+    relay = db.session.get(SmtpRelay, relay_id)
+    if relay:
+        relay.sent_count = 0
+        relay.error_count = 0
+        relay.consecutive_failures = 0
+        relay.last_error = None
+        relay.disabled_until = None
+        db.session.commit()
+        flash(f'Estatísticas do relay {relay.name} zeradas.', 'success')
+
+    return redirect(url_for('main.admin'))
+
+@main_bp.route('/admin/relays/<int:relay_id>/delete')
+@login_required
+def delete_relay(relay_id):
+    if current_user.role != 'admin': return redirect(url_for('main.history'))
+
+    relay = db.session.get(SmtpRelay, relay_id)
+    if relay:
+        db.session.delete(relay)
+        db.session.commit()
+        flash(f'Relay {relay.name} excluído.', 'success')
+
+    return redirect(url_for('main.admin'))
 
 @main_bp.route('/history')
 @login_required
@@ -74,7 +167,81 @@ def campaign_detail(campaign_id):
         flash('Campanha não encontrada.', 'error')
         return redirect(url_for('main.history'))
 
-    return render_template('campaign_detail.html', campaign=campaign)
+    # Campanha arquivada: os destinatários só são lidos do arquivo se pedidos (?archived=1)
+    archived_recipients = None
+    if campaign.is_archived and request.args.get('archived'):
+        archived_recipients = list(archive.iter_archived_recipients(campaign.id))
+
+    return render_template('campaign_detail.html', campaign=campaign,
+                           archived_recipients=archived_recipients)
+
+
+EXPORT_BATCH_SIZE = 5000
+
+def _iter_archived_rows(campaign_id):
+    """Mesmas colunas de recipients.iter_recipient_rows, lidas do arquivo da campanha arquivada."""
+    for row in archive.iter_archived_recipients(campaign_id):
+        yield SimpleNamespace(**row)
+
+
+@main_bp.route('/campaign/<int:campaign_id>/export.csv')
+@login_required
+def export_campaign_csv(campaign_id):
+    """
+    Baixa os destinatários e status da campanha em CSV (streaming).
+    Use ?gzip=1 para receber o arquivo compactado (.csv.gz).
+    """
+    campaign = db.session.get(Campaign, campaign_id)
+    if not campaign:
+        flash('Campanha não encontrada.', 'error')
+        return redirect(url_for('main.history'))
+
+    lead_fields = list(campaign.lead_fields or [])
+    use_gzip = request.args.get('gzip') in ('1', 'true', 'sim')
+    is_archived = campaign.is_archived
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # wbits=31 -> formato gzip (com cabeçalho), compactado em fluxo
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+
+        def flush():
+            data = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+            return compressor.compress(data) if compressor else data
+
+        writer.writerow(['id', 'nome', 'email', 'status', 'variacao', 'tentativas'] + [f.lower() for f in lead_fields])
+        rows_in_buffer = 0
+        if is_archived:
+            rows = _iter_archived_rows(campaign_id)
+        else:
+            rows = recipients.iter_recipient_rows(campaign_id, batch_size=EXPORT_BATCH_SIZE)
+        for row in rows:
+            fields = row.fields or {}
+            writer.writerow([row.id, row.nome, row.email, row.status,
+                             chr(ord('A') + (row.variant or 0)), row.attempts or 0]
+                            + [fields.get(name, '') for name in lead_fields])
+            rows_in_buffer += 1
+            if rows_in_buffer >= 1000:
+                chunk = flush()
+                if chunk:
+                    yield chunk
+                rows_in_buffer = 0
+
+        chunk = flush()
+        if chunk:
+            yield chunk
+        if compressor:
+            yield compressor.flush()
+
+    filename = f'campanha_{campaign_id}.csv' + ('.gz' if use_gzip else '')
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/gzip' if use_gzip else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 
 # --- ROTAS DA FASE 4 ---
@@ -84,28 +251,38 @@ def campaign_detail(campaign_id):
 def new_campaign():
     """
     Mostra o formulário inicial para criar uma nova campanha.
-    (ATUALIZADO: Agora também passa o 'csv_filename')
+    (ATUALIZADO: Agora também passa a lista de leads selecionada)
     """
     # Pega os dados da URL (se existirem)
     subject_val = request.args.get('subject', '')
     theme_val = request.args.get('theme', '')
-    csv_filename_val = request.args.get('csv_filename', '') 
+    lead_list_id_val = request.args.get('lead_list_id', type=int)
     cta_url_val = request.args.get('cta_url', '') # <-- NOVO
+    num_variants_val = request.args.get('num_variants', 1, type=int)
 
     # Passa os valores para o template
+    return _render_new_campaign(subject=subject_val,
+                                theme=theme_val,
+                                lead_list_id=lead_list_id_val,
+                                cta_url=cta_url_val, # <-- NOVO
+                                num_variants=num_variants_val)
+
+
+def _render_new_campaign(**context):
+    """Renderiza o formulário de campanha com as listas de leads disponíveis."""
+    lead_lists = LeadList.query.order_by(LeadList.name).all()
     return render_template('new_campaign.html',
-                           subject=subject_val,
-                           theme=theme_val,
-                           csv_filename=csv_filename_val, 
-                           cta_url=cta_url_val) # <-- NOVO
+                           lead_lists=lead_lists,
+                           max_variants=core_logic.MAX_VARIANTS,
+                           **context)
 
 
 @main_bp.route('/campaign/generate_preview', methods=['POST'])
 @login_required
 def generate_preview():
     """
-    Recebe o formulário (Assunto, Tema, CSV).
-    (ATUALIZADO: Lógica inteligente de arquivo + Coleta de Configurações)
+    Recebe o formulário (Assunto, Tema, CSV ou lista de leads).
+    (ATUALIZADO: CSV novo vira/atualiza uma lista de leads + Coleta de Configurações)
     """
     try:
         # 1. Pega os dados do formulário
@@ -113,39 +290,48 @@ def generate_preview():
         theme = request.form.get('theme')
         cta_url = request.form.get('cta_url') # <-- Pega o CTA do form
         new_csv_file = request.files.get('leads_csv')
-        existing_csv_filename = request.form.get('existing_csv_filename')
+        list_name = (request.form.get('list_name') or '').strip()
+        lead_list_id = request.form.get('lead_list_id', type=int)
+        num_variants = request.form.get('num_variants', 1, type=int) or 1
+        num_variants = max(1, min(num_variants, core_logic.MAX_VARIANTS))
+        stream_preview = bool(request.form.get('stream_preview'))
+        # "Gerar nova versão": ignora o cache de prévias (mesmo tema = HTML novo)
+        regenerate = bool(request.form.get('regenerate'))
 
         if not all([subject, theme, cta_url]): # <-- Valida o CTA
             flash('Assunto, Tema e URL do CTA são obrigatórios.', 'error')
             return redirect(url_for('main.new_campaign'))
 
-        # --- Lógica de Arquitetura do CSV ---
-        csv_path = None
-        csv_filename_to_use = None
-        upload_folder = os.path.join(current_app.instance_path, 'uploads')
-        os.makedirs(upload_folder, exist_ok=True)
-
+        # --- Lista de Leads ---
+        # Um CSV novo é importado para a lista (só grava contatos novos/alterados);
+        # sem CSV, reutiliza a lista escolhida.
         if new_csv_file and new_csv_file.filename != '':
-            print("[Roteador] Novo CSV detectado. Salvando...")
-            random_hex = secrets.token_hex(8)
-            _, f_ext = os.path.splitext(new_csv_file.filename)
-            csv_filename_to_use = random_hex + f_ext
-            csv_path = os.path.join(upload_folder, csv_filename_to_use)
-            new_csv_file.save(csv_path)
-        
-        elif existing_csv_filename:
-            print(f"[Roteador] Reutilizando CSV existente: {existing_csv_filename}")
-            csv_filename_to_use = existing_csv_filename
-            csv_path = os.path.join(upload_folder, csv_filename_to_use)
-            
-            if not os.path.exists(csv_path):
-                flash(f'Erro: O arquivo CSV salvo ({existing_csv_filename}) não foi encontrado. Por favor, envie-o novamente.', 'error')
+            print("[Roteador] Novo CSV detectado. Importando para a lista de leads...")
+            leads_df = core_logic.get_leads(new_csv_file.stream)
+            if leads_df is None or leads_df.empty:
+                flash("Erro no CSV (ele deve conter as colunas 'nome' e 'email').", 'error')
+                return redirect(url_for('main.new_campaign', subject=subject, theme=theme, cta_url=cta_url))
+
+            list_name = list_name or os.path.splitext(new_csv_file.filename)[0]
+            lead_list, stats = contacts.import_lead_list(list_name, leads_df, user=current_user)
+            if lead_list is None:
+                flash(f"Erro no CSV: nenhum e-mail válido encontrado. A lista '{list_name}' não foi alterada.", 'error')
+                return redirect(url_for('main.new_campaign', subject=subject, theme=theme, cta_url=cta_url))
+            flash(f"Lista '{lead_list.name}' importada: {stats['total']} leads "
+                  f"({stats['inserted']} novos, {stats['updated']} alterados).", 'success')
+
+        elif lead_list_id:
+            print(f"[Roteador] Reutilizando lista de leads: {lead_list_id}")
+            lead_list = db.session.get(LeadList, lead_list_id)
+
+            if not lead_list:
+                flash('Erro: A lista de leads selecionada não foi encontrada. Por favor, envie o CSV novamente.', 'error')
                 return redirect(url_for('main.new_campaign', subject=subject, theme=theme, cta_url=cta_url))
         else:
-            flash('Você deve enviar um arquivo de leads (.csv).', 'error')
+            flash('Você deve enviar um arquivo de leads (.csv) ou escolher uma lista.', 'error')
             return redirect(url_for('main.new_campaign', subject=subject, theme=theme, cta_url=cta_url))
         
-        # --- Fim da Lógica do CSV ---
+        # --- Fim da Lógica da Lista ---
 
         # 3. Carrega TODAS as configurações do DB
         settings = get_settings_dict()
@@ -157,27 +343,66 @@ def generate_preview():
             flash('Chave da API e Nome da Empresa não configurados no Menu Admin.', 'error')
             return redirect(url_for('main.new_campaign'))
 
+        # Modo streaming (só para 1 variação): a página abre um SSE e
+        # recebe o HTML aos pedaços, em vez de esperar a resposta inteira
+        if stream_preview and num_variants == 1:
+            return _render_new_campaign(stream_url=url_for('main.generate_preview_stream', theme=theme,
+                                                           cta_url=cta_url, lead_list_id=lead_list.id,
+                                                           regenerate=1 if regenerate else None),
+                                        subject=subject,
+                                        theme=theme,
+                                        cta_url=cta_url,
+                                        lead_list_id=lead_list.id,
+                                        num_variants=num_variants,
+                                        stream_preview=stream_preview)
+
+        # Colunas extras da lista viram placeholders (ex: [CIDADE])
+        extra_placeholders = lead_list.field_names or []
+
         # 4. Chama nosso "motor" (core_logic) para gerar o HTML
         #    (ESTA É A LINHA QUE CORRIGE O ERRO)
-        html_content = core_logic.generate_ai_html(
-            api_key=api_key,
-            email_theme=theme,
-            cta_url=cta_url,
-            company_name=company_name,
-            logo_url=logo_url
-        )
+        if num_variants > 1:
+            # Teste A/B: gera as N variações em paralelo
+            html_variants = core_logic.generate_ai_html_variants(
+                api_key=api_key,
+                email_theme=theme,
+                cta_url=cta_url,
+                company_name=company_name,
+                logo_url=logo_url,
+                num_variants=num_variants,
+                extra_placeholders=extra_placeholders,
+                regenerate=regenerate
+            )
+        else:
+            html_content = core_logic.generate_ai_html(
+                api_key=api_key,
+                email_theme=theme,
+                cta_url=cta_url,
+                company_name=company_name,
+                logo_url=logo_url,
+                extra_placeholders=extra_placeholders,
+                regenerate=regenerate
+            )
+            html_variants = [html_content] if html_content else []
         
-        if not html_content:
+        if not html_variants:
             flash('Erro ao gerar HTML pela API (Timeout ou Erro 504). Tente novamente.', 'error')
             return redirect(url_for('main.new_campaign'))
+
+        failed_variants = num_variants - len(html_variants)
+        if failed_variants:
+            flash(f'Atenção: {failed_variants} de {num_variants} variações falharam na API. '
+                  f'A campanha terá só {len(html_variants)} variação(ões); gere de novo para tentar todas.', 'warning')
         
         # 5. Sucesso! Renderiza a página novamente, passando os dados
-        return render_template('new_campaign.html',
-                               html_preview=html_content,
-                               subject=subject,
-                               theme=theme,
-                               cta_url=cta_url, # <-- Passa o CTA de volta
-                               csv_filename=csv_filename_to_use)
+        return _render_new_campaign(html_preview=html_variants[0],
+                                    html_variants=html_variants,
+                                    subject=subject,
+                                    theme=theme,
+                                    cta_url=cta_url, # <-- Passa o CTA de volta
+                                    lead_list_id=lead_list.id,
+                                    num_variants=num_variants,
+                                    stream_preview=stream_preview)
 
     except Exception as e:
         # O erro que você viu foi pego aqui
@@ -185,6 +410,53 @@ def generate_preview():
         flash(f'Ocorreu um erro inesperado: {e}', 'error')
         return redirect(url_for('main.new_campaign'))
 
+@main_bp.route('/campaign/generate_preview/stream')
+@login_required
+def generate_preview_stream():
+    """
+    Server-Sent Events: envia o HTML gerado pela IA aos pedaços.
+    Eventos: 'chunk' (HTML parcial), 'done' (HTML final limpo) e 'error'.
+    """
+    theme = request.args.get('theme')
+    cta_url = request.args.get('cta_url')
+    lead_list_id = request.args.get('lead_list_id', type=int)
+    regenerate = bool(request.args.get('regenerate'))
+
+    settings = get_settings_dict()
+    api_key = settings.get('API_KEY')
+    company_name = settings.get('COMPANY_NAME')
+    logo_url = settings.get('LOGO_URL')
+
+    extra_placeholders = []
+    if lead_list_id:
+        lead_list = db.session.get(LeadList, lead_list_id)
+        if lead_list:
+            extra_placeholders = lead_list.field_names or []
+
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        if not all([theme, cta_url, api_key, company_name]):
+            yield sse('error', 'Tema, URL do CTA, Chave da API e Nome da Empresa são obrigatórios.')
+            return
+        for event, data in core_logic.stream_ai_html(
+            api_key=api_key,
+            email_theme=theme,
+            cta_url=cta_url,
+            company_name=company_name,
+            logo_url=logo_url,
+            extra_placeholders=extra_placeholders,
+            regenerate=regenerate
+        ):
+            yield sse(event, data)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @main_bp.route('/campaign/send', methods=['POST'])
 @login_required
 def send_campaign():
@@ -197,8 +469,16 @@ def send_campaign():
         subject = request.form.get('subject')
         theme = request.form.get('theme')
         cta_url = request.form.get('cta_url')
-        csv_filename = request.form.get('csv_filename')
-        html_content = request.form.get('html_content')
+        lead_list_id = request.form.get('lead_list_id', type=int)
+        # Uma entrada 'html_content' por variação (Teste A/B)
+        html_variants = [html for html in request.form.getlist('html_content') if html]
+
+        # Compacta o HTML (menos bytes em CADA mensagem enviada)
+        html_bytes_original = sum(len(html.encode('utf-8')) for html in html_variants)
+        html_variants = [core_logic.compact_html(html) for html in html_variants]
+        html_bytes_compact = sum(len(html.encode('utf-8')) for html in html_variants)
+        print(f"[Flask] HTML compactado: {html_bytes_original} -> {html_bytes_compact} bytes por mensagem.")
+        html_content = html_variants[0] if html_variants else None
         
         schedule_time_str = request.form.get('schedule_time')
         
@@ -222,45 +502,63 @@ def send_campaign():
             generated_html=html_content,
             status=status_inicial,
             user=current_user,
-            scheduled_at=scheduled_datetime_utc
+            scheduled_at=scheduled_datetime_utc,
+            html_bytes_original=html_bytes_original,
+            html_bytes_compact=html_bytes_compact
         )
         db.session.add(new_camp)
+
+        if len(html_variants) > 1:
+            for index, html in enumerate(html_variants):
+                db.session.add(CampaignVariant(campaign=new_camp, index=index, html=html))
         
-        # 3. Processa o CSV
-        upload_folder = os.path.join(current_app.instance_path, 'uploads')
-        csv_path = os.path.join(upload_folder, csv_filename)
-        leads_df = core_logic.get_leads(csv_path)
-        
-        if leads_df is None or leads_df.empty:
-            flash('Erro no CSV.', 'error')
+        # 3. Lista de leads: a campanha só referencia a lista
+        lead_list = db.session.get(LeadList, lead_list_id) if lead_list_id else None
+        if lead_list is None or not lead_list.contact_count:
+            db.session.rollback()
+            flash('Erro: lista de leads não encontrada ou vazia.', 'error')
             return redirect(url_for('main.new_campaign'))
 
-        for index, row in leads_df.iterrows():
-            recipient = Recipient(
-                nome=row['nome'], email=row['email'], 
-                campaign=new_camp, status='Aguardando'
+        new_camp.lead_list = lead_list
+        # Cópia dos placeholders da lista no momento do envio
+        new_camp.lead_fields = lead_list.field_names
+        db.session.flush()
+
+        # Estado de entrega por contato, criado no próprio banco (INSERT ... SELECT),
+        # sem trazer os contatos para o Python. Variação = (contact_id + id da campanha) % N:
+        # divide a lista igualmente e, a cada campanha, o mesmo contato cai em outra
+        # variação (o Teste A/B não fica preso a grupos fixos de contatos).
+        num_variants = max(len(html_variants), 1)
+        db.session.execute(
+            insert(Recipient).from_select(
+                ['campaign_id', 'contact_id', 'status', 'variant', 'attempts'],
+                db.select(
+                    literal(new_camp.id),
+                    LeadListMember.contact_id,
+                    literal('Aguardando'),
+                    (LeadListMember.contact_id + new_camp.id) % num_variants,
+                    literal(0)
+                ).where(LeadListMember.list_id == lead_list.id)
             )
-            db.session.add(recipient)
+        )
+        recipient_count = lead_list.contact_count
 
         db.session.commit()
 
         # --- FILA REDIS ---
         try:
-            redis_url = current_app.config.get('REDIS_URL', 'redis://localhost:6379')
-            conn = redis.from_url(redis_url)
-            q = Queue(connection=conn)
-            
             if scheduled_datetime_utc:
                 # AGENDAR
                 # Atribui à variável 'job' (CORREÇÃO DO ERRO DE REFERÊNCIA)
-                job = q.enqueue_at(scheduled_datetime_utc, 'worker.run_campaign_task', new_camp.id)
+                job = task_queue.enqueue_campaign(new_camp.id, scheduled_at=scheduled_datetime_utc,
+                                                  recipient_count=recipient_count)
                 
                 new_camp.job_id = job.id
                 db.session.commit()
                 flash(f'Campanha AGENDADA para {local_dt.strftime("%d/%m/%Y %H:%M")}!', 'success')
             else:
                 # IMEDIATO
-                job = q.enqueue('worker.run_campaign_task', new_camp.id)
+                job = task_queue.enqueue_campaign(new_camp.id, recipient_count=recipient_count)
                 
                 new_camp.job_id = job.id
                 db.session.commit()
@@ -362,25 +660,19 @@ def cancel_campaign(campaign_id):
         return redirect(url_for('main.campaign_detail', campaign_id=campaign_id))
 
     try:
-        # Conecta ao Redis
-        redis_url = current_app.config.get('REDIS_URL', 'redis://localhost:6379')
-        conn = redis.from_url(redis_url)
-        
         # Busca a tarefa e cancela
-        job = Job.fetch(campaign.job_id, connection=conn)
-        job.cancel()
-        
-        # Atualiza o DB
-        campaign.status = 'Cancelado'
-        campaign.job_id = None # Remove o vínculo
-        db.session.commit()
-        
-        flash('Agendamento cancelado com sucesso.', 'success')
-    except NoSuchJobError:
-        # Se a tarefa já sumiu do Redis
-        campaign.status = 'Cancelado (Erro: Tarefa não encontrada)'
-        db.session.commit()
-        flash('A tarefa não foi encontrada no Redis, mas a campanha foi marcada como cancelada.', 'warning')
+        if task_queue.cancel_job(campaign.job_id):
+            # Atualiza o DB
+            campaign.status = 'Cancelado'
+            campaign.job_id = None # Remove o vínculo
+            db.session.commit()
+            
+            flash('Agendamento cancelado com sucesso.', 'success')
+        else:
+            # Se a tarefa já sumiu do Redis
+            campaign.status = 'Cancelado (Erro: Tarefa não encontrada)'
+            db.session.commit()
+            flash('A tarefa não foi encontrada no Redis, mas a campanha foi marcada como cancelada.', 'warning')
     except Exception as e:
         flash(f'Erro ao cancelar: {e}', 'error')
 
@@ -395,23 +687,13 @@ def send_now_campaign(campaign_id):
         flash('Ação inválida.', 'error')
         return redirect(url_for('main.campaign_detail', campaign_id=campaign_id))
 
-    # 1. Cancela o agendamento antigo primeiro
-    if campaign.job_id:
-        try:
-            redis_url = current_app.config.get('REDIS_URL', 'redis://localhost:6379')
-            conn = redis.from_url(redis_url)
-            job = Job.fetch(campaign.job_id, connection=conn)
-            job.cancel()
-        except:
-            pass # Ignora erro se não achar, o importante é enviar agora
-
-    # 2. Envia imediatamente (cria nova tarefa)
+    # Cancela o agendamento antigo e envia imediatamente (nova tarefa),
+    # numa única ida ao Redis
     try:
-        redis_url = current_app.config.get('REDIS_URL', 'redis://localhost:6379')
-        conn = redis.from_url(redis_url)
-        q = Queue(connection=conn)
-        q.enqueue('worker.run_campaign_task', campaign.id)
+        recipient_count = Recipient.query.filter_by(campaign_id=campaign.id).count()
+        job = task_queue.send_now(campaign.job_id, campaign.id, recipient_count=recipient_count)
         
+        campaign.job_id = job.id
         campaign.status = 'Na Fila (Forçado)'
         campaign.scheduled_at = None # Limpa a data pois foi forçado
         db.session.commit()
@@ -420,4 +702,11 @@ def send_now_campaign(campaign_id):
     except Exception as e:
         flash(f'Erro ao enviar: {e}', 'error')
 
-    return redirect(url_for('main.campaign_detail', campaign_id=campaign_id))
\ No newline at end of file
+    return redirect(url_for('main.campaign_detail', campaign_id=campaign_id))
+
+
+@main_bp.route('/health')
+def health():
+    """Health check (sem login) para o Docker/monitoramento: verifica o Redis."""
+    redis_status = task_queue.health_check()
+    return jsonify({'redis': redis_status}), (200 if redis_status['ok'] else 503)
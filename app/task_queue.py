@@ -0,0 +1,181 @@
+"""
+Gateway do Redis / RQ (fila de tarefas).
+Um ÚNICO pool de conexões por processo (web ou worker), reaproveitado por
+todas as rotas e tarefas, em vez de abrir uma conexão TCP nova a cada ação.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+import redis
+from flask import current_app
+from rq import Queue
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
+
+DEFAULT_QUEUE = 'default'
+CAMPAIGN_TASK = 'worker.run_campaign_task'
+ARCHIVE_TASK = 'worker.archive_campaigns_task'
+
+# --- Filas por prioridade ---
+# Os workers escutam na ordem abaixo: uma campanha grande na 'bulk' não
+# trava as campanhas pequenas/urgentes. A 'default' continua sendo ouvida
+# (por último) para tarefas antigas que já estavam no Redis.
+URGENT_QUEUE = 'urgent'       # Envio imediato de campanhas pequenas
+SCHEDULED_QUEUE = 'scheduled' # Agendamentos e reenvios
+BULK_QUEUE = 'bulk'           # Campanhas grandes (>= BULK_QUEUE_THRESHOLD destinatários)
+PRIORITY_QUEUES = [URGENT_QUEUE, SCHEDULED_QUEUE, BULK_QUEUE, DEFAULT_QUEUE]
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _redis_url(redis_url=None):
+    if redis_url:
+        return redis_url
+    return current_app.config.get('REDIS_URL', 'redis://localhost:6379')
+
+
+def get_connection(redis_url=None):
+    """
+    Retorna um cliente Redis ligado ao pool compartilhado desta URL.
+    O cliente é leve; quem abre (e reaproveita) os sockets é o pool.
+    """
+    url = _redis_url(redis_url)
+    pool = _pools.get(url)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(url)
+            if pool is None:
+                max_connections = None
+                try:
+                    max_connections = current_app.config.get('REDIS_MAX_CONNECTIONS')
+                except RuntimeError:
+                    pass # Fora do contexto do Flask: sem limite
+                pool = redis.ConnectionPool.from_url(url, max_connections=max_connections)
+                _pools[url] = pool
+    return redis.Redis(connection_pool=pool)
+
+
+def get_queue(name=DEFAULT_QUEUE, connection=None):
+    """Retorna a fila RQ 'name' usando o pool compartilhado."""
+    return Queue(name, connection=connection or get_connection())
+
+
+# --- Operações de campanha ---
+
+def choose_queue(recipient_count, scheduled=False):
+    """Escolhe a fila da campanha pelo tamanho (e se é agendada)."""
+    threshold = current_app.config.get('BULK_QUEUE_THRESHOLD', 5000)
+    if recipient_count >= threshold:
+        return BULK_QUEUE
+    if scheduled:
+        return SCHEDULED_QUEUE
+    return URGENT_QUEUE
+
+
+def enqueue_campaign(campaign_id, scheduled_at=None, recipient_count=0, queue_name=None):
+    """
+    Coloca a campanha na fila (imediato) ou agenda para 'scheduled_at' (UTC). Retorna o Job.
+    Sem 'queue_name', a fila é escolhida pelo tamanho da campanha (choose_queue).
+    """
+    queue_name = queue_name or choose_queue(recipient_count, scheduled=bool(scheduled_at))
+    q = get_queue(queue_name)
+    if scheduled_at:
+        return q.enqueue_at(scheduled_at, CAMPAIGN_TASK, campaign_id)
+    return q.enqueue(CAMPAIGN_TASK, campaign_id)
+
+
+def cancel_job(job_id):
+    """Cancela uma tarefa. Retorna False se ela não existir mais no Redis."""
+    try:
+        Job.fetch(job_id, connection=get_connection()).cancel()
+        return True
+    except NoSuchJobError:
+        return False
+
+
+def send_now(job_id, campaign_id, recipient_count=0, queue_name=None):
+    """
+    Cancela o agendamento antigo (se existir) e enfileira a campanha para
+    agora, tudo em UMA ida ao Redis (pipeline MULTI/EXEC).
+    """
+    queue_name = queue_name or choose_queue(recipient_count)
+    conn = get_connection()
+    q = get_queue(queue_name, connection=conn)
+
+    old_job = None
+    if job_id:
+        try:
+            old_job = Job.fetch(job_id, connection=conn)
+        except NoSuchJobError:
+            pass # Ignora se não achar, o importante é enviar agora
+
+    with conn.pipeline() as pipe:
+        if old_job is not None and not old_job.is_canceled:
+            old_job.cancel(pipeline=pipe)
+        jobs = q.enqueue_many([Queue.prepare_data(CAMPAIGN_TASK, (campaign_id,))], pipeline=pipe)
+        pipe.execute()
+    return jobs[0]
+
+
+def enqueue_many(func, args_list, queue_name=DEFAULT_QUEUE):
+    """Enfileira várias tarefas (ex: lotes/chunks) em um único pipeline."""
+    if not args_list:
+        return []
+    q = get_queue(queue_name)
+    job_datas = [Queue.prepare_data(func, tuple(args)) for args in args_list]
+    return q.enqueue_many(job_datas)
+
+
+def schedule_many(delay, func, args_list, queue_name=DEFAULT_QUEUE):
+    """
+    Agenda várias tarefas para daqui a 'delay' (timedelta) em um único
+    pipeline (equivalente a vários 'enqueue_in', mas com uma ida ao Redis).
+    """
+    if not args_list:
+        return []
+    conn = get_connection()
+    q = get_queue(queue_name, connection=conn)
+    when = datetime.now(timezone.utc) + delay
+    jobs = []
+    with conn.pipeline() as pipe:
+        for args in args_list:
+            job = q.create_job(func, args=tuple(args))
+            q.schedule_job(job, when, pipeline=pipe)
+            jobs.append(job)
+        pipe.execute()
+    return jobs
+
+
+def health_check():
+    """Verifica se o Redis responde. Retorna um dict com 'ok', latência e erro (se houver)."""
+    start = time.perf_counter()
+    try:
+        get_connection().ping()
+        return {'ok': True, 'latency_ms': round((time.perf_counter() - start) * 1000, 2)}
+    except Exception as e:
+        return {'ok': False, 'error': str(e)}
+
+
+# --- Contadores por janela de tempo (limite por minuto dos relays SMTP) ---
+
+def incr_window(key, window=60):
+    """
+    Soma 1 ao contador da janela atual (janela fixa de 'window' segundos),
+    compartilhado por todos os processos. Retorna (contagem, segundos até a próxima janela).
+    """
+    now = time.time()
+    slot = int(now // window)
+    slot_key = f'{key}:{slot}'
+    with get_connection().pipeline() as pipe:
+        pipe.incr(slot_key)
+        pipe.expire(slot_key, window * 2)
+        count, _ = pipe.execute()
+    return count, (slot + 1) * window - now
+
+
+def window_count(key, window=60):
+    """Valor atual do contador da janela (sem incrementar)."""
+    value = get_connection().get(f'{key}:{int(time.time() // window)}')
+    return int(value or 0)
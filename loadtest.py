@@ -0,0 +1,338 @@
+"""
+Teste de carga da camada web (Flask).
+
+Cria um banco SQLite sintético (N campanhas x M destinatários), troca o Redis
+e o Gemini por stubs e dispara requisições concorrentes contra as rotas
+/history, /campaign/<id> e /campaign/send. No final imprime p50/p95/p99 e
+queries por requisição de cada rota e sai com código 1 se algum orçamento
+de latência (p95) for estourado.
+
+Uso:
+    python loadtest.py --campaigns 10000 --recipients 200
+    python loadtest.py --reuse-db --budget history=300 --budget campaign_detail=150
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert, text
+
+from app import create_app, db
+from app import blobs, core_logic, task_queue
+from app.models import Campaign, Contact, LeadList, LeadListMember, Recipient, User
+
+# Orçamentos padrão de latência (p95, em milissegundos)
+DEFAULT_BUDGETS = {
+    'history': 1000,
+    'campaign_detail': 300,
+    'campaign_send': 1500,
+}
+
+LOADTEST_USER = 'loadtest'
+LOADTEST_PASSWORD = 'loadtest-senha'
+SEED_CHUNK = 50000
+
+STUB_HTML = (
+    '<html><body><h1>Olá [NOME]!</h1>'
+    '<p>Oferta especial para você.</p>'
+    '<a href="https://example.com">Comprar</a></body></html>'
+)
+
+
+# --- Stubs (Redis e Gemini) ---
+
+class _StubJob:
+    def __init__(self):
+        self.id = str(uuid.uuid4())
+
+
+def install_stubs():
+    """Substitui o gateway do Redis e a chamada ao Gemini por versões em memória."""
+    task_queue.enqueue_campaign = lambda *args, **kwargs: _StubJob()
+    task_queue.send_now = lambda *args, **kwargs: _StubJob()
+    task_queue.cancel_job = lambda *args, **kwargs: True
+    task_queue.health_check = lambda: {'ok': True, 'latency_ms': 0.0}
+    core_logic.generate_ai_html = lambda *args, **kwargs: STUB_HTML
+    core_logic.generate_ai_html_variants = lambda *args, num_variants=2, **kwargs: [STUB_HTML] * num_variants
+
+
+# --- Contagem de queries (por thread) ---
+
+_query_counter = threading.local()
+
+
+def install_query_counter(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        _query_counter.count = getattr(_query_counter, 'count', 0) + 1
+
+
+# --- Banco sintético ---
+
+def seed_database(app, num_campaigns, recipients_per_campaign):
+    """Cria o usuário de teste e as campanhas/destinatários sintéticos (inserts em lote)."""
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as conn:
+            conn.execute(text('PRAGMA journal_mode=WAL'))
+
+        if not User.query.filter_by(username=LOADTEST_USER).first():
+            user = User(username=LOADTEST_USER, email='loadtest@example.com', role='admin')
+            user.set_password(LOADTEST_PASSWORD)
+            db.session.add(user)
+            db.session.commit()
+        user_id = User.query.filter_by(username=LOADTEST_USER).first().id
+
+        existing = Campaign.query.count()
+        if existing >= num_campaigns:
+            print(f"[LoadTest] Banco já possui {existing} campanhas. Pulando a criação de dados.")
+            return
+
+        print(f"[LoadTest] Criando {num_campaigns} campanhas x {recipients_per_campaign} destinatários...")
+        start = time.perf_counter()
+        now = datetime.utcnow()
+        statuses = ['Concluído (Sucessos: 10, Falhas: 0)', 'Agendado', 'Na Fila', 'Enviando']
+        html_hash = blobs.put_html(STUB_HTML) # Mesmo HTML para todas: um único blob
+        campaign_rows = [
+            {
+                'subject': f'Campanha sintética {i}',
+                'theme': 'Tema de teste de carga',
+                'cta_url': 'https://example.com',
+                'html_hash': html_hash,
+                'status': statuses[i % len(statuses)],
+                'created_at': now - timedelta(minutes=i),
+                'user_id': user_id,
+            }
+            for i in range(num_campaigns)
+        ]
+        for offset in range(0, len(campaign_rows), SEED_CHUNK):
+            db.session.execute(insert(Campaign), campaign_rows[offset:offset + SEED_CHUNK])
+        db.session.commit()
+
+        # Contatos compartilhados: cada campanha reenvia para a mesma base
+        contact_rows = [
+            {'nome': f'Lead {j}', 'email': f'lead{j}@example.com', 'fields': {'CIDADE': f'Cidade {j % 50}'}}
+            for j in range(recipients_per_campaign)
+        ]
+        for offset in range(0, len(contact_rows), SEED_CHUNK):
+            db.session.execute(insert(Contact), contact_rows[offset:offset + SEED_CHUNK])
+        db.session.commit()
+        contact_ids = [row[0] for row in db.session.query(Contact.id).order_by(Contact.id).all()]
+
+        campaign_ids = [row[0] for row in db.session.query(Campaign.id).all()]
+        recipient_statuses = ['Enviado', 'Enviado', 'Enviado', 'Falhou', 'Aguardando']
+        batch = []
+        total = 0
+        for campaign_id in campaign_ids:
+            for j, contact_id in enumerate(contact_ids):
+                batch.append({
+                    'campaign_id': campaign_id,
+                    'contact_id': contact_id,
+                    'status': recipient_statuses[j % len(recipient_statuses)],
+                    'variant': 0,
+                    'attempts': 1,
+                })
+                if len(batch) >= SEED_CHUNK:
+                    db.session.execute(insert(Recipient), batch)
+                    db.session.commit()
+                    total += len(batch)
+                    batch = []
+        if batch:
+            db.session.execute(insert(Recipient), batch)
+            db.session.commit()
+            total += len(batch)
+        print(f"[LoadTest] {len(campaign_ids)} campanhas e {total} destinatários criados "
+              f"em {time.perf_counter() - start:.1f}s.")
+
+
+def seed_lead_list(app, num_leads):
+    """Cria (ou reaproveita) a lista de leads usada pela rota /campaign/send."""
+    name = f'loadtest_{num_leads}'
+    with app.app_context():
+        lead_list = LeadList.query.filter_by(name=name).first()
+        if lead_list:
+            return lead_list.id
+        existing = {email for (email,) in db.session.query(Contact.email)}
+        new_rows = [
+            {'nome': f'Lead {i}', 'email': f'lead{i}@example.com', 'fields': {'CIDADE': f'Cidade {i % 50}'}}
+            for i in range(num_leads) if f'lead{i}@example.com' not in existing
+        ]
+        for offset in range(0, len(new_rows), SEED_CHUNK):
+            db.session.execute(insert(Contact), new_rows[offset:offset + SEED_CHUNK])
+        contact_ids = [row[0] for row in db.session.query(Contact.id).order_by(Contact.id).limit(num_leads)]
+        lead_list = LeadList(name=name, field_names=['CIDADE'], contact_count=len(contact_ids))
+        db.session.add(lead_list)
+        db.session.flush()
+        db.session.execute(insert(LeadListMember),
+                           [{'list_id': lead_list.id, 'contact_id': cid} for cid in contact_ids])
+        db.session.commit()
+        return lead_list.id
+
+
+# --- Execução da carga ---
+
+def _logged_client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'username': LOADTEST_USER, 'password': LOADTEST_PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError('Falha no login do usuário de teste de carga.')
+    return client
+
+
+def _build_requests(campaign_ids, lead_list_id):
+    """
+    Cada 'request' é uma função (client) -> ok (bool): cada rota define o
+    próprio critério de sucesso.
+    """
+    def history(client):
+        return client.get('/history').status_code == 200
+
+    def campaign_detail(client):
+        return client.get(f'/campaign/{random.choice(campaign_ids)}').status_code == 200
+
+    def campaign_send(client):
+        # A rota redireciona (302) tanto no sucesso (/history) quanto nos erros
+        # (/campaign/new): só o destino do redirect diz se a campanha foi criada
+        response = client.post('/campaign/send', data={
+            'subject': 'Carga',
+            'theme': 'Tema de teste de carga',
+            'cta_url': 'https://example.com',
+            'lead_list_id': lead_list_id,
+            'html_content': STUB_HTML,
+        })
+        return response.status_code == 302 and response.headers.get('Location', '').endswith('/history')
+
+    return {'history': history, 'campaign_detail': campaign_detail, 'campaign_send': campaign_send}
+
+
+def run_endpoint(app, name, request_fn, num_requests, concurrency):
+    """Dispara 'num_requests' com 'concurrency' threads. Retorna a lista de (ms, queries, ok)."""
+    local = threading.local()
+    results = []
+    results_lock = threading.Lock()
+
+    def one(_):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = _logged_client(app)
+        _query_counter.count = 0
+        start = time.perf_counter()
+        ok = request_fn(client)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with results_lock:
+            results.append((elapsed_ms, _query_counter.count, ok))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(num_requests)))
+    return results
+
+
+def percentile(sorted_values, pct):
+    """Percentil pelo método 'nearest-rank'."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(name, results, budget_ms):
+    latencies = sorted(ms for ms, _, _ in results)
+    queries = [q for _, q, _ in results]
+    errors = sum(1 for _, _, ok in results if not ok)
+    p95 = percentile(latencies, 95)
+    return {
+        'endpoint': name,
+        'requests': len(results),
+        'errors': errors,
+        'p50': percentile(latencies, 50),
+        'p95': p95,
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else 0.0,
+        'queries': sum(queries) / len(queries) if queries else 0.0,
+        'budget': budget_ms,
+        'passed': errors == 0 and (budget_ms is None or p95 <= budget_ms),
+    }
+
+
+def print_report(rows):
+    header = f"{'Rota':<16}{'Req':>6}{'Erros':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'máx':>9}{'Queries':>9}{'Orç.p95':>9}  Resultado"
+    print()
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        budget = f"{row['budget']:.0f}" if row['budget'] is not None else '-'
+        print(f"{row['endpoint']:<16}{row['requests']:>6}{row['errors']:>7}"
+              f"{row['p50']:>9.1f}{row['p95']:>9.1f}{row['p99']:>9.1f}{row['max']:>9.1f}"
+              f"{row['queries']:>9.1f}{budget:>9}  {'OK' if row['passed'] else 'ESTOUROU'}")
+    print('(latências em ms; queries = média de queries SQL por requisição)')
+
+
+def parse_budgets(values):
+    budgets = dict(DEFAULT_BUDGETS)
+    for value in values or []:
+        name, _, ms = value.partition('=')
+        if name not in DEFAULT_BUDGETS or not ms:
+            raise SystemExit(f"Orçamento inválido: '{value}' (use rota=ms, rotas: {', '.join(DEFAULT_BUDGETS)})")
+        budgets[name] = float(ms)
+    return budgets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Teste de carga das rotas web.')
+    parser.add_argument('--db', help='Arquivo SQLite do teste (padrão: arquivo temporário)')
+    parser.add_argument('--reuse-db', action='store_true', help='Não recria dados se o banco já estiver populado')
+    parser.add_argument('--campaigns', type=int, default=10000, help='Nº de campanhas sintéticas')
+    parser.add_argument('--recipients', type=int, default=100, help='Destinatários por campanha')
+    parser.add_argument('--send-leads', type=int, default=100, help='Contatos da lista usada em /campaign/send')
+    parser.add_argument('--requests', type=int, default=100, help='Requisições por rota')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requisições simultâneas')
+    parser.add_argument('--endpoints', nargs='+', default=list(DEFAULT_BUDGETS), choices=list(DEFAULT_BUDGETS))
+    parser.add_argument('--budget', action='append', metavar='ROTA=MS',
+                        help='Orçamento de latência p95 em ms (ex: history=500). Pode repetir.')
+    args = parser.parse_args(argv)
+
+    budgets = parse_budgets(args.budget)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='loadtest_'), 'loadtest.db')
+    if os.path.exists(db_path) and not args.reuse_db:
+        os.remove(db_path)
+
+    install_stubs()
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(db_path),
+        'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30, 'check_same_thread': False}},
+    })
+    print(f"[LoadTest] Banco: {db_path}")
+
+    seed_database(app, args.campaigns, args.recipients)
+    lead_list_id = seed_lead_list(app, args.send_leads)
+
+    with app.app_context():
+        install_query_counter(db.engine)
+        campaign_ids = [row[0] for row in db.session.query(Campaign.id).limit(100000).all()]
+
+    request_fns = _build_requests(campaign_ids, lead_list_id)
+    rows = []
+    for name in args.endpoints:
+        print(f"[LoadTest] {name}: {args.requests} requisições, {args.concurrency} simultâneas...")
+        results = run_endpoint(app, name, request_fns[name], args.requests, args.concurrency)
+        rows.append(summarize(name, results, budgets.get(name)))
+
+    print_report(rows)
+    failed = [row['endpoint'] for row in rows if not row['passed']]
+    if failed:
+        print(f"\n[LoadTest] FALHOU: {', '.join(failed)} fora do orçamento (ou com erros).")
+        return 1
+    print("\n[LoadTest] Todas as rotas dentro do orçamento.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+from app.core_logic import compact_html
+
+
+def test_downlevel_revealed_block_is_kept():
+    html = ('<!--[if !mso]><!--> <div>VISIBLE CONTENT</div> <!--<![endif]--> '
+            '<p>after</p> <!-- footer note -->')
+    assert compact_html(html) == '<!--[if !mso]><!--><div>VISIBLE CONTENT</div><!--<![endif]--><p>after</p>'
+
+
+def test_outlook_conditional_comment_is_kept():
+    html = '<!--[if mso]>\n  <table><tr><td>Outlook</td></tr></table>\n<![endif]--><p>ok</p>'
+    result = compact_html(html)
+    assert result.startswith('<!--[if mso]>')
+    assert '<![endif]-->' in result
+    assert 'Outlook' in result
+
+
+def test_plain_comment_does_not_cross_conditional_terminator():
+    html = '<!-- a --><div>1</div><!--[if !mso]><!--><div>2</div><!--<![endif]--><!-- b -->'
+    assert compact_html(html) == '<div>1</div><!--[if !mso]><!--><div>2</div><!--<![endif]-->'
+
+
+def test_style_fallback_pairs_are_kept():
+    html = '<div style="background:#fff; background:linear-gradient(#fff,#000)">x</div>'
+    assert compact_html(html) == '<div style="background:#fff;background:linear-gradient(#fff,#000)">x</div>'
+
+
+def test_identical_style_declarations_are_deduplicated():
+    html = '<div style="color: red; font-size:12px; color:red">x</div>'
+    assert compact_html(html) == '<div style="font-size:12px;color:red">x</div>'
+
+
+def test_quote_entities_in_font_stack_are_kept():
+    html = '<p style="font-family:&quot;Helvetica Neue&quot;, Arial; color:#333">x</p>'
+    assert compact_html(html) == '<p style="font-family:&quot;Helvetica Neue&quot;, Arial;color:#333">x</p>'
+
+
+def test_numeric_quote_entities_are_kept():
+    html = "<p style=\"font-family:&#39;Open Sans&#39;, sans-serif; color:#333; color:#333\">x</p>"
+    assert compact_html(html) == "<p style=\"font-family:&#39;Open Sans&#39;, sans-serif;color:#333\">x</p>"
+
+
+def test_semicolon_inside_entity_quoted_value_does_not_split():
+    html = '<p style="font-family:&quot;A;B&quot;; color:red">x</p>'
+    assert compact_html(html) == '<p style="font-family:&quot;A;B&quot;;color:red">x</p>'
+
+
+def test_unparseable_style_is_left_unchanged():
+    html = '<p style="color:red; garbage; color:red">x</p>'
+    assert compact_html(html) == html
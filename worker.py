@@ -1,10 +1,19 @@
 import os
-import redis
-from rq import Queue
+import sys
+import time
+import signal
+import argparse
+import multiprocessing
+from datetime import datetime, timedelta
+from sqlalchemy import func
 from rq.worker import SimpleWorker
 from app import create_app, db
-from app.models import Settings, Campaign, Recipient
+from app.models import Campaign, Recipient
 from app import core_logic
+from app import task_queue
+from app import relays
+from app import archive
+from app import recipients
 
 # --- Configuração ---
 
@@ -12,12 +21,123 @@ from app import core_logic
 app = create_app()
 app.app_context().push()
 
-# Pega a URL do Redis (padrão é localhost)
-redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379')
-conn = redis.from_url(redis_url)
+# Conexão do pool compartilhado (mesmo gateway usado pelo Flask)
+conn = task_queue.get_connection()
+
+# Filas por prioridade (urgent > scheduled > bulk > default)
+queues = [task_queue.get_queue(name, connection=conn) for name in task_queue.PRIORITY_QUEUES]
+
+# --- Funções auxiliares de envio ---
+
+def _compile_campaign_templates(campaign):
+    """
+    Variações de HTML (Teste A/B). Sem variações = HTML único da campanha.
+    Cada HTML é compilado UMA vez; por destinatário só trocamos os placeholders.
+    Retorna (field_names, default_template, variant_templates).
+    """
+    field_names = campaign.lead_fields or []
+    default_template = core_logic.compile_template(campaign.generated_html, field_names)
+    variant_templates = {
+        variant.index: core_logic.compile_template(variant.html, field_names)
+        for variant in campaign.variants
+    }
+    return field_names, default_template, variant_templates
+
+
+def _deliver(recipient, subject, relay_pool, templates):
+    """
+    Envia para UM destinatário e registra a tentativa (status + histórico).
+    Retorna o DeliveryResult.
+    """
+    field_names, default_template, variant_templates = templates
+    try:
+        # Chama o motor de envio (o pool escolhe o relay SMTP e faz o failover)
+        result = relay_pool.send(
+            recipient.nome,
+            recipient.email,
+            subject,
+            variant_templates.get(recipient.variant, default_template),
+            fields=core_logic.build_recipient_fields(
+                recipient.nome, recipient.email, field_names, recipient.field_values(field_names)
+            )
+        )
+    except Exception as e:
+        print(f"[Worker] Erro inesperado ao enviar para {recipient.email}: {e}")
+        result = core_logic.DeliveryResult(False, error=f'Exceção: {e}')
+
+    recipient.attempts = (recipient.attempts or 0) + 1
+    # Reatribui a lista para o SQLAlchemy detectar a mudança na coluna JSON
+    recipient.attempt_history = (recipient.attempt_history or []) + [{
+        'at': datetime.utcnow().isoformat(timespec='seconds'),
+        'ok': result.ok,
+        'code': result.code,
+        'error': (result.error or '')[:200] or None,
+        'relay': result.relay,
+    }]
+    return result
+
+
+def _apply_result(recipient, result, max_attempts):
+    """
+    Define o status do destinatário a partir do resultado.
+    Retorna True se a falha for transitória e ainda couber nova tentativa.
+    """
+    if result:
+        recipient.status = 'Enviado'
+        return False
+    if result.transient and recipient.attempts < max_attempts:
+        recipient.status = 'Aguardando Reenvio'
+        return True
+    recipient.status = f'Falhou ({result.error})' if result.error and result.error.startswith('Exceção') else 'Falhou'
+    return False
+
+
+def _schedule_retries(campaign_id, recipient_ids, attempt):
+    """
+    Agenda (via RQ, como um 'enqueue_in') o reenvio de um LOTE de destinatários,
+    com backoff exponencial: RETRY_BASE_DELAY * 2^(tentativa-1).
+    """
+    if not recipient_ids:
+        return
+    delay = app.config['RETRY_BASE_DELAY'] * (2 ** (attempt - 1))
+    task_queue.schedule_many(timedelta(seconds=delay), 'worker.retry_recipients_task',
+                             [(campaign_id, list(recipient_ids), attempt)],
+                             queue_name=task_queue.SCHEDULED_QUEUE)
+    print(f"[Worker] {len(recipient_ids)} reenvios agendados em {delay}s (tentativa {attempt + 1}).")
+
+
+def _update_campaign_summary(campaign):
+    """Recalcula o status final da campanha a partir dos destinatários."""
+    if campaign.is_archived:
+        return # Destinatários já foram para o arquivo; os totais ficam em archive_counts
+    counts = dict(
+        db.session.query(Recipient.status, func.count(Recipient.id))
+        .filter(Recipient.campaign_id == campaign.id)
+        .group_by(Recipient.status)
+        .all()
+    )
+    success_count = counts.get('Enviado', 0)
+    pending_count = counts.get('Aguardando Reenvio', 0)
+    fail_count = sum(n for status, n in counts.items() if status.startswith('Falhou'))
+
+    summary = f'Sucessos: {success_count}, Falhas: {fail_count}'
+    if pending_count:
+        summary += f', Reenvios pendentes: {pending_count}'
+    campaign.status = f'Concluído ({summary})'
+    campaign.completed_at = datetime.utcnow()
+    db.session.commit()
+
+
+def _iter_recipient_batches(campaign_id, batch_size):
+    """
+    Percorre os destinatários ainda não processados ('Aguardando') em lotes por
+    "keyset", em vez de carregar a relação 'campaign.recipients' inteira na memória.
+    Como cada lote é salvo ao terminar, rodar a campanha de novo (ex: depois de
+    um worker interrompido) continua de onde parou.
+    """
+    stmt = db.select(Recipient).where(Recipient.campaign_id == campaign_id, Recipient.status == 'Aguardando')
+    return recipients.iter_keyset_batches(stmt, Recipient.id, batch_size, scalars=True)
 
-# A fila 'default' é onde o Flask colocará as tarefas
-q = Queue(connection=conn)
 
 # --- A Função da Tarefa (O "Trabalho Pesado") ---
 
@@ -25,6 +145,7 @@ def run_campaign_task(campaign_id):
     """
     Esta é a função que o worker executará.
     Ela busca a campanha, os leads e envia os e-mails, um por um.
+    Falhas transitórias são agendadas para reenvio em lotes (sem travar este loop).
     """
     print(f"--- [Worker] Tarefa recebida: Processando Campanha ID: {campaign_id} ---")
     
@@ -39,79 +160,287 @@ def run_campaign_task(campaign_id):
         campaign.status = 'Enviando'
         db.session.commit()
 
-        # 3. Buscar as configurações de SMTP no DB
-        settings_from_db = Settings.query.all()
-        settings = {setting.key: setting.value for setting in settings_from_db}
-        
-        smtp_config = {
-            'server': settings.get('SMTP_SERVER'),
-            'port': settings.get('SMTP_PORT'),
-            'user': settings.get('SMTP_USER'),
-            'pass': settings.get('SMTP_PASS')
-        }
+        # 3. Buscar os relays SMTP no DB (ou o SMTP único das Configurações)
+        relay_pool = relays.load_pool()
         
-        if not all(smtp_config.values()):
+        if not relay_pool:
             print("[Worker] Erro: Configurações de SMTP incompletas.")
             campaign.status = 'Falhou (Config SMTP)'
             db.session.commit()
             return
 
-        # 4. Buscar todos os destinatários desta campanha
-        recipients = campaign.recipients
-        total_leads = len(recipients)
-        success_count = 0
-        fail_count = 0
+        templates = _compile_campaign_templates(campaign)
+        subject = campaign.subject
+        max_attempts = app.config['RETRY_MAX_ATTEMPTS']
+        retry_batch_size = app.config['RETRY_BATCH_SIZE']
+
+        # 4. Contar os destinatários pendentes desta campanha (sem carregá-los)
+        total_leads = (
+            db.session.query(func.count(Recipient.id))
+            .filter(Recipient.campaign_id == campaign_id, Recipient.status == 'Aguardando')
+            .scalar()
+        )
+        retry_ids = []
+        sent = 0
         
-        print(f"[Worker] Encontrados {total_leads} destinatários. Iniciando disparos...")
-
-        # 5. Loop de Envio (O trabalho pesado)
-        for i, recipient in enumerate(recipients):
-            print(f"[Worker] Enviando {i+1}/{total_leads} para: {recipient.email}")
-            
-            try:
-                # Chama o motor de envio
-                success = core_logic.send_email(
-                    smtp_config,
-                    recipient.nome,
-                    recipient.email,
-                    campaign.subject,
-                    campaign.generated_html
-                )
-                
-                if success:
-                    recipient.status = 'Enviado'
-                    success_count += 1
-                else:
-                    recipient.status = 'Falhou'
-                    fail_count += 1
-                    
-            except Exception as e:
-                print(f"[Worker] Erro inesperado ao enviar para {recipient.email}: {e}")
-                recipient.status = f'Falhou (Exceção: {e})'
-                fail_count += 1
-            
-            # Salva o status de *cada* destinatário no DB
+        print(f"[Worker] Encontrados {total_leads} destinatários pendentes. Iniciando disparos...")
+
+        # 5. Loop de Envio (O trabalho pesado), lote a lote
+        for batch in _iter_recipient_batches(campaign_id, app.config['WORKER_BATCH_SIZE']):
+            for recipient in batch:
+                sent += 1
+                print(f"[Worker] Enviando {sent}/{total_leads} para: {recipient.email}")
+
+                result = _deliver(recipient, subject, relay_pool, templates)
+                if _apply_result(recipient, result, max_attempts):
+                    retry_ids.append(recipient.id)
+
+            # Salva o status do lote (e as estatísticas dos relays) no DB e tira os objetos
+            # da sessão: a memória do worker fica constante, qualquer que seja o tamanho da campanha
+            relay_pool.flush_stats()
             db.session.commit()
+            for recipient in batch:
+                db.session.expunge(recipient)
+
+            # Os reenvios saem em lotes, enquanto o loop principal continua
+            if len(retry_ids) >= retry_batch_size:
+                _schedule_retries(campaign_id, retry_ids, attempt=1)
+                retry_ids = []
+
+        _schedule_retries(campaign_id, retry_ids, attempt=1)
 
         # 6. Finalizar a campanha
-        campaign.status = f'Concluído (Sucessos: {success_count}, Falhas: {fail_count})'
-        db.session.commit()
+        _update_campaign_summary(campaign)
         print(f"--- [Worker] Tarefa finalizada: Campanha ID: {campaign_id} ---")
 
     except Exception as e:
         # Se algo der errado ANTES do loop (ex: buscar campanha)
         print(f"[Worker] Erro CRÍTICO na tarefa: {e}")
+        db.session.rollback()
         campaign = db.session.get(Campaign, campaign_id)
         if campaign:
             campaign.status = f'Falhou (Erro de Worker: {e})'
             db.session.commit()
-        
+
+
+def retry_recipients_task(campaign_id, recipient_ids, attempt):
+    """
+    Reenvia um lote de destinatários que tiveram falha transitória.
+    'attempt' é o nº de tentativas já feitas; quem falhar de novo (transitório)
+    é reagendado com o dobro do atraso, até RETRY_MAX_ATTEMPTS.
+    """
+    print(f"--- [Worker] Reenvio: Campanha ID {campaign_id}, {len(recipient_ids)} destinatários (tentativa {attempt + 1}) ---")
+
+    campaign = db.session.get(Campaign, campaign_id)
+    if not campaign:
+        print(f"[Worker] Erro: Campanha ID {campaign_id} não encontrada.")
+        return
+
+    max_attempts = app.config['RETRY_MAX_ATTEMPTS']
+    relay_pool = relays.load_pool()
+    if not relay_pool:
+        print("[Worker] Erro: Configurações de SMTP incompletas.")
+        if attempt + 1 < max_attempts:
+            # Sem SMTP não adianta tentar agora; tenta de novo mais tarde
+            _schedule_retries(campaign_id, recipient_ids, attempt + 1)
+        else:
+            Recipient.query.filter(
+                Recipient.id.in_(recipient_ids), Recipient.status == 'Aguardando Reenvio'
+            ).update({'status': 'Falhou (Config SMTP)'}, synchronize_session=False)
+            db.session.commit()
+        return
+
+    templates = _compile_campaign_templates(campaign)
+    retry_ids = []
+
+    pending = (
+        Recipient.query
+        .filter(Recipient.id.in_(recipient_ids), Recipient.status == 'Aguardando Reenvio')
+        .all()
+    )
+    for recipient in pending:
+        result = _deliver(recipient, campaign.subject, relay_pool, templates)
+        if _apply_result(recipient, result, max_attempts):
+            retry_ids.append(recipient.id)
+        relay_pool.flush_stats()
+        db.session.commit()
+
+    _schedule_retries(campaign_id, retry_ids, attempt + 1)
+
+    # Só atualiza o resumo se a campanha já terminou o loop principal
+    if campaign.status.startswith('Concluído'):
+        _update_campaign_summary(campaign)
+
+def archive_campaigns_task(days, every_hours=None):
+    """
+    Arquiva os destinatários das campanhas concluídas há mais de 'days' dias.
+    Com 'every_hours', a tarefa se reagenda (arquivamento periódico via RQ).
+    """
+    print(f"--- [Worker] Arquivamento: campanhas concluídas há mais de {days} dias ---")
+    try:
+        archived, archived_recipients = archive.archive_completed_campaigns(days)
+        print(f"--- [Worker] Arquivamento finalizado: {archived} campanhas, {archived_recipients} destinatários ---")
+    except Exception as e:
+        print(f"[Worker] Erro no arquivamento: {e}")
+        db.session.rollback()
+        raise
+    finally:
+        if every_hours:
+            task_queue.schedule_many(timedelta(hours=every_hours), task_queue.ARCHIVE_TASK,
+                                     [(days, every_hours)], queue_name=task_queue.SCHEDULED_QUEUE)
+            print(f"[Worker] Próximo arquivamento em {every_hours}h.")
+
+# --- Pool de Processos (um SimpleWorker por processo) ---
+
+MONITOR_INTERVAL = 30    # segundos entre cada relatório de status dos processos
+SHUTDOWN_TIMEOUT = 60    # segundos para cada processo terminar a tarefa atual
+
+
+def _run_worker(queue_names, index):
+    """Processo filho: um SimpleWorker escutando as filas na ordem de prioridade."""
+    # Só o pai recebe o Ctrl+C do terminal; ele repassa um único SIGTERM
+    # (um segundo sinal faria o RQ abortar a tarefa atual)
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    # O processo filho não pode reaproveitar conexões abertas pelo pai
+    db.engine.dispose(close=False)
+    child_conn = task_queue.get_connection()
+    child_queues = [task_queue.get_queue(name, connection=child_conn) for name in queue_names]
+
+    print(f"--- [Worker #{index}] PID {os.getpid()} ouvindo: {', '.join(queue_names)} ---")
+    worker = SimpleWorker(child_queues, connection=child_conn)
+    # SIGTERM/SIGINT: o RQ faz "warm shutdown" (termina a tarefa atual e sai)
+    worker.work(with_scheduler=True)
+
+
+def _start_process(queue_names, index):
+    process = multiprocessing.Process(target=_run_worker, args=(queue_names, index),
+                                      name=f'worker-{index}')
+    process.start()
+    return process
+
+
+def _report_status(processes):
+    """Imprime o estado de cada processo e da tarefa atual de cada worker RQ."""
+    for index, process in processes.items():
+        print(f"[Monitor] Worker #{index} PID {process.pid}: {'vivo' if process.is_alive() else 'parado'}")
+    try:
+        for rq_worker in SimpleWorker.all(connection=conn):
+            job_id = rq_worker.get_current_job_id()
+            print(f"[Monitor]   {rq_worker.name}: {rq_worker.get_state()}"
+                  f"{f' (tarefa {job_id})' if job_id else ''}")
+        for queue in queues:
+            print(f"[Monitor]   Fila '{queue.name}': {queue.count} tarefas")
+    except Exception as e:
+        print(f"[Monitor] Erro ao consultar o Redis: {e}")
+
+
+def _current_jobs(processes):
+    """Tarefa em execução em cada processo filho ({pid: Job}), pelo registro dos workers no Redis."""
+    pids = {process.pid for process in processes}
+    jobs = {}
+    try:
+        for rq_worker in SimpleWorker.all(connection=conn):
+            if rq_worker.pid in pids:
+                job = rq_worker.get_current_job()
+                if job is not None:
+                    jobs[rq_worker.pid] = job
+    except Exception as e:
+        print(f"[Monitor] Erro ao consultar o Redis: {e}")
+    return jobs
+
+
+def _requeue_interrupted(job):
+    """
+    Recoloca na fila a tarefa de um processo encerrado à força. Campanhas
+    retomam só os destinatários ainda 'Aguardando'; se não der para
+    reenfileirar, a campanha fica 'Interrompida' (em vez de 'Enviando' para sempre).
+    """
+    campaign = None
+    if job.func_name == task_queue.CAMPAIGN_TASK and job.args:
+        campaign = db.session.get(Campaign, job.args[0])
+    try:
+        new_job = task_queue.enqueue_many(job.func_name, [job.args], queue_name=job.origin)[0]
+        print(f"[Worker] Tarefa {job.id} ({job.func_name}) interrompida e reenfileirada como {new_job.id}.")
+        if campaign is not None:
+            campaign.status = 'Na Fila'
+            campaign.job_id = new_job.id
+    except Exception as e:
+        print(f"[Worker] Erro ao reenfileirar a tarefa {job.id}: {e}")
+        if campaign is not None:
+            campaign.status = 'Interrompida'
+    if campaign is not None:
+        db.session.commit()
+
+
+def run_pool(num_workers, queue_names):
+    """
+    Processo pai: inicia 'num_workers' processos, reinicia os que morrerem e,
+    ao receber SIGTERM/SIGINT, repassa o sinal e espera todos terminarem.
+    """
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            print(f"--- [Worker] Sinal {signum} recebido. Encerrando processos (aguardando tarefas atuais)... ---")
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    processes = {index: _start_process(queue_names, index) for index in range(num_workers)}
+    last_report = time.monotonic()
+
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                print(f"[Monitor] Worker #{index} (PID {process.pid}) saiu com código {process.exitcode}. Reiniciando...")
+                processes[index] = _start_process(queue_names, index)
+        if time.monotonic() - last_report >= MONITOR_INTERVAL:
+            _report_status(processes)
+            last_report = time.monotonic()
+
+    # Encerramento gracioso
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate() # SIGTERM -> warm shutdown do RQ
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    for process in processes.values():
+        process.join(max(0, deadline - time.monotonic()))
+    stuck = [process for process in processes.values() if process.is_alive()]
+    if stuck:
+        # Anota as tarefas em andamento ANTES de matar os processos
+        interrupted = _current_jobs(stuck)
+        for process in stuck:
+            print(f"[Worker] PID {process.pid} não terminou a tempo. Forçando saída.")
+            process.kill()
+            process.join()
+            if process.pid in interrupted:
+                _requeue_interrupted(interrupted[process.pid])
+    print("--- [Worker] Todos os processos foram encerrados. ---")
+
+
 # --- Ponto de Entrada do Worker ---
 
 if __name__ == '__main__':
-    print("--- [Worker] Iniciando 'ouvinte' na fila 'default' ---")
-    # Passa a conexão 'conn' e a fila 'q' diretamente para o Worker
-    worker = SimpleWorker([q], connection=conn)
+    parser = argparse.ArgumentParser(description='Inicia os workers de envio de campanhas.')
+    parser.add_argument('-w', '--workers', type=int, default=app.config['WORKER_PROCESSES'],
+                        help='Número de processos worker (padrão: WORKER_PROCESSES)')
+    parser.add_argument('-q', '--queues', nargs='+', default=task_queue.PRIORITY_QUEUES,
+                        help='Filas a escutar, em ordem de prioridade')
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        print(f"--- [Worker] Iniciando 'ouvinte' nas filas: {', '.join(args.queues)} ---")
+        # Passa a conexão 'conn' e as filas diretamente para o Worker
+        worker = SimpleWorker([task_queue.get_queue(name, connection=conn) for name in args.queues],
+                              connection=conn)
 
-    # Inicia o "ouvinLte"
-    worker.work(with_scheduler=True)
\ No newline at end of file
+        # Inicia o "ouvinte"
+        worker.work(with_scheduler=True)
+    else:
+        print(f"--- [Worker] Iniciando {args.workers} processos nas filas: {', '.join(args.queues)} ---")
+        run_pool(args.workers, args.queues)
+        sys.exit(0)